@@ -1,28 +1,70 @@
 # AI generated: Claude Code
 
 import gradio as gr
+import asyncio
+import atexit
+import os
+import time
 from dotenv import load_dotenv
 from extraction.pdf_to_text_chunks import process_syllabus
-from rag.rag_system import RAGSystem
+from extraction.structured_chunker import StructuredChunker
+from extraction.syllabus_cache import SyllabusCache
+from rag.embedding_service import get_embedding_service
+from rag.shared_corpus import SharedCorpus, CorpusView
+from rag.answer_cache import AnswerCache
+from utils.context_builder import ContextBuilder
 from utils.syllabus_parser import SyllabusParser
 from utils.grade_calculator import GradeCalculator
 from integrated_chat import RAGChat
 
 load_dotenv()
 
+# LLM calls go through utils.llm_client: one client and connection pool per process (FAKE_LLM=1 for canned offline replies)
 parser = SyllabusParser()
+embedding_service = get_embedding_service( # one model per process
+    backend=os.getenv("EMBEDDING_BACKEND", "torch"), # onnx for the faster CPU runtime
+    num_threads=int(os.getenv("EMBEDDING_THREADS", "0")) or None,
+    model_path=os.getenv("EMBEDDING_MODEL_PATH"), # local model directory, for offline servers
+    quantize=os.getenv("EMBEDDING_QUANTIZE", "").lower() in ("1", "true")
+)
+if os.getenv("QUERY_CACHE_PATH"):
+    # repeat questions skip the model across restarts too
+    embedding_service.query_cache.path = os.getenv("QUERY_CACHE_PATH")
+    embedding_service.query_cache.load(embedding_service.query_cache.path)
+    atexit.register(embedding_service.query_cache.save)
+# each distinct syllabus embedded once, sessions only hold views, and boilerplate shared between syllabi is embedded once too
+shared_corpus = SharedCorpus(embedding_service, hybrid=True, dedupe=True)
+# repeat questions about the same syllabus are answered once, across every student who uploaded it
+answer_cache = AnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL_HOURS", "6")) * 3600,
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+)
+# syllabus context in each answer prompt is capped at this many tokens
+context_builder = ContextBuilder(max_context_tokens=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200")))
+syllabus_cache = SyllabusCache(
+    os.getenv("SYLLABUS_CACHE_DIR", ".syllabus_cache"),
+    max_bytes=int(os.getenv("SYLLABUS_CACHE_MAX_MB", "500")) * 1024 * 1024
+)
+chunker = None # CHUNKER=window keeps the old fixed 600 word windows
+if os.getenv("CHUNKER", "structured") == "structured":
+    chunker = StructuredChunker( # section/sentence aligned chunks sized in the embedding model's tokens
+        max_tokens=int(os.getenv("CHUNK_MAX_TOKENS", "200")),
+        count_tokens=embedding_service.count_tokens,
+        tokenizer_name=embedding_service.model_name
+    )
 
 def initialize_session():
     """Initialize session-specific data"""
     return {
-        'rag_system': RAGSystem(),
+        'rag_system': CorpusView(shared_corpus),
         'calculators': {},
         'course_names': [],
         'chatbot': None,
         'current_course': None
     }
 
-def add_course(pdf_file, course_name, session_state):
+async def add_course(pdf_file, course_name, session_state):
     """Process uploaded syllabus and add course"""
     
     if not pdf_file:
@@ -37,28 +79,45 @@ def add_course(pdf_file, course_name, session_state):
         return f"Course {course_name} already exists!", gr.update(choices=session_state['course_names']), None, session_state
     
     try:
-        result = process_syllabus(pdf_file.name)
+        timings = {}
+        start = time.perf_counter()
+        result = await asyncio.to_thread(process_syllabus, pdf_file.name, cache=syllabus_cache, chunker=chunker)
+        timings['extract'] = time.perf_counter() - start
         
         if not result:
             return "Failed to process PDF", gr.update(choices=session_state['course_names']), None, session_state
         
-        grading_info = parser.parse_grading_structure(result['text'])
+        # the grading parse is a network round trip awaited on the event loop, embedding is CPU work
+        # on a worker thread, so they run side by side
+        parse_task = asyncio.create_task(timed_async(parser.aparse_grading_structure(result['text'])))
+        try:
+            _, timings['embed'] = await asyncio.to_thread(timed, index_course, session_state['rag_system'], course_name, result)
+        except Exception:
+            parse_task.cancel()
+            raise
+        try:
+            grading_info, timings['parse'] = await parse_task
+        except Exception:
+            session_state['rag_system'].remove_course(course_name)
+            raise
+        timings['total'] = time.perf_counter() - start
+        print(f"Added {course_name}: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
         
         if not grading_info:
+            session_state['rag_system'].remove_course(course_name)
             return "Failed to parse grading structure", gr.update(choices=session_state['course_names']), None, session_state
         
         grading = grading_info["grading_breakdown"]
         counts = grading_info["assignment_counts"]
         session_state['calculators'][course_name] = GradeCalculator(course_name, grading, counts)
-        
-        session_state['rag_system'].add_course(course_name, result['chunks'])
         session_state['course_names'].append(course_name)
-        session_state['rag_system'].index_chunks()
         
         session_state['chatbot'] = RAGChat(
             session_state['rag_system'], 
             session_state['calculators'], 
-            session_state['course_names']
+            session_state['course_names'],
+            answer_cache=answer_cache,
+            context_builder=context_builder
         )
         
         return (
@@ -72,31 +131,66 @@ def add_course(pdf_file, course_name, session_state):
         return f"Error adding course: {str(e)}", gr.update(choices=session_state['course_names']), None, session_state
 
 
-def chat_with_bot(message, history, session_state):
-    """Handle chat messages"""
+def timed(fn, *args):
+    """Runs fn and returns (its result, seconds taken)"""
+    start = time.perf_counter()
+    return fn(*args), time.perf_counter() - start
+
+
+async def timed_async(coroutine):
+    start = time.perf_counter()
+    return await coroutine, time.perf_counter() - start
+
+
+def index_course(rag_system, course_name, result):
+    """Adds a processed syllabus to the student's RAG system and fills the cache with its embeddings"""
+    # a syllabus someone already uploaded is either still in the shared corpus or comes back
+    # from the cache with its embeddings, so nothing gets re-encoded. They're keyed by cache_id,
+    # quantized ONNX vectors mustn't be mixed into a torch index of the same model or vice versa
+    cached_embeddings = syllabus_cache.get_embeddings(result['cache_key'], embedding_service.cache_id)
+    pages = None
+    if result.get('chunk_pages'):
+        pages = [chunk_pages[0] if chunk_pages else 0 for chunk_pages in result['chunk_pages']]
+    rag_system.add_course(course_name, result['chunks'], cached_embeddings, doc_id=result['cache_key'],
+                          pages=pages, sections=result.get('chunk_sections'))
+    rag_system.index_chunks()
+    if cached_embeddings is None:
+        syllabus_cache.put_embeddings(
+            result['cache_key'],
+            embedding_service.cache_id,
+            # near-duplicates are searched under another chunk's vector, the cache gets their own
+            rag_system.get_course_embeddings(course_name, result['chunks'])
+        )
+
+
+async def chat_with_bot(message, history, session_state):
+    """Handle chat messages, streaming the answer into the chat as it arrives"""
     if history is None:
         history = []
     
     if not session_state['chatbot']:
-        return history + [
+        yield history + [
             {"role": "user", "content": message},
             {"role": "assistant", "content": "Please add at least one course first!"}
         ], session_state
+        return
     
     if not message or not message.strip():
-        return history, session_state
+        yield history, session_state
+        return
     
+    history = history + [
+        {"role": "user", "content": message},
+        {"role": "assistant", "content": ""}
+    ]
     try:
-        response = session_state['chatbot'].chat(message.strip())
-        return history + [
-            {"role": "user", "content": message},
-            {"role": "assistant", "content": response}
-        ], session_state
+        # awaited on the event loop, so many conversations can be in flight without a thread each
+        async for partial_answer in session_state['chatbot'].achat_stream(message.strip()):
+            history[-1] = {"role": "assistant", "content": partial_answer}
+            yield history, session_state
     except Exception as e:
-        return history + [
-            {"role": "user", "content": message},
-            {"role": "assistant", "content": f"Error: {str(e)}"}
-        ], session_state
+        history[-1] = {"role": "assistant", "content": f"Error: {str(e)}"}
+        yield history, session_state
 
 
 def select_course(course_name, session_state):
@@ -259,8 +353,8 @@ with gr.Blocks(title="Course Assistant") as app:
         outputs=add_course_modal
     )
     
-    def submit_and_close(pdf, name, state):
-        message, courses_update, _, state = add_course(pdf, name, state)
+    async def submit_and_close(pdf, name, state):
+        message, courses_update, _, state = await add_course(pdf, name, state)
         return message, courses_update, gr.update(visible=False), state
     
     submit_course_btn.click(
@@ -312,4 +406,7 @@ with gr.Blocks(title="Course Assistant") as app:
     )
 
 if __name__ == "__main__":
+    # gradio runs one event of each kind at a time by default, the async handlers hold no thread
+    # while waiting on the LLM so many chats can be in flight (utils.llm_client caps the requests)
+    app.queue(default_concurrency_limit=int(os.getenv("CHAT_CONCURRENCY", "64")))
     app.launch(share=True)
\ No newline at end of file
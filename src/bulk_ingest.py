@@ -0,0 +1,199 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from extraction.pdf_to_text_chunks import iter_pdf_pages, iter_chunks
+from extraction.structured_chunker import StructuredChunker
+from rag.rag_system import RAGSystem
+
+
+def find_syllabi(source):
+    """Returns [(pdf_path, course_name)] from a directory of PDFs or a JSON manifest.
+        A manifest is a list of {"path": ..., "course": ...}, relative paths are resolved
+        against the manifest's folder. In a directory the course name is the filename up to
+        the first underscore (cs240_fall2025.pdf -> CS240)"""
+    if os.path.isdir(source):
+        pdfs = sorted(f for f in os.listdir(source) if f.endswith('.pdf'))
+        return [(os.path.join(source, f), f.split('_')[0].upper()) for f in pdfs]
+
+    with open(source) as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(source))
+    return [(os.path.join(base_dir, entry["path"]), entry["course"].strip().upper()) for entry in manifest]
+
+
+def extract_syllabus(job):
+    """Runs in a worker process: PDF -> chunks for one file"""
+    pdf_path, course_name, chunk_size, overlap, chunker = job
+    num_pages = 0
+    def count_pages():
+        nonlocal num_pages
+        for page in iter_pdf_pages(pdf_path):
+            num_pages += 1
+            yield page
+
+    try:
+        if chunker is not None:
+            chunks = list(chunker.iter_chunks(count_pages()))
+        else:
+            chunks = list(iter_chunks(count_pages(), chunk_size, overlap))
+    except Exception as e:
+        return {'path': pdf_path, 'course': course_name, 'error': str(e)}
+
+    return {
+        'path': pdf_path,
+        'course': course_name,
+        'chunks': [chunk['text'] for chunk in chunks],
+        'chunk_pages': [chunk['pages'][0] if chunk['pages'] else 0 for chunk in chunks],
+        'chunk_sections': [chunk['section'] for chunk in chunks] if chunker is not None else None,
+        'pages': num_pages
+    }
+
+
+class BulkIngestor:
+    """Ingests a whole department's syllabi into one RAGSystem saved under out_dir.
+        Extraction and chunking run across a process pool, chunks are embedded in large batches,
+        and progress is checkpointed so a stopped run picks up where it left off"""
+
+    def __init__(self, out_dir, workers=None, embed_batch_size=2048, checkpoint_every=200,
+                 chunk_size=600, overlap=50, embedder=None, index_backend='flat', recall_target=0.95, chunker=None,
+                 dedupe=False):
+        self.out_dir = out_dir
+        self.index_dir = os.path.join(out_dir, "index")
+        self.progress_path = os.path.join(out_dir, "progress.json")
+        self.workers = workers or os.cpu_count()
+        self.max_in_flight = 2 * self.workers #extraction jobs submitted ahead of the one being consumed
+        self.embed_batch_size = embed_batch_size
+        self.checkpoint_every = checkpoint_every
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.chunker = chunker #sent to every worker, so its count_tokens must pickle cheaply
+        self.embedder = embedder
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.done = set() #pdf paths already in the saved index
+        self.failed = {} #pdf path -> error
+        if os.path.exists(self.progress_path) and os.path.exists(self.index_dir):
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+            self.done = set(progress["done"])
+            self.failed = progress.get("failed", {})
+            self.rag = RAGSystem.load(self.index_dir, mmap=False, embedder=embedder)
+            print(f"Resuming: {len(self.done)} syllabi already ingested")
+        else:
+            self.rag = RAGSystem(embedder=embedder, index_backend=index_backend, recall_target=recall_target, dedupe=dedupe)
+
+        self.stats = {"files": 0, "pages": 0, "chunks": 0, "embed_seconds": 0.0}
+
+    def _extract_in_order(self, pool, jobs):
+        """Yields extract_syllabus results in job order with at most max_in_flight jobs submitted,
+            so the chunks of files extracted ahead don't pile up while embedding catches up
+            (pool.map would submit every job at once and hold all their results)"""
+        jobs = iter(jobs)
+        in_flight = deque(pool.submit(extract_syllabus, job) for job in itertools.islice(jobs, self.max_in_flight))
+        while in_flight:
+            result = in_flight.popleft().result()
+            job = next(jobs, None)
+            if job is not None:
+                in_flight.append(pool.submit(extract_syllabus, job))
+            yield result
+
+    def run(self, syllabi):
+        """Ingests every (pdf_path, course_name) not already done, returns throughput stats"""
+        todo = [(path, course) for path, course in syllabi if path not in self.done]
+        print(f"Ingesting {len(todo)} syllabi with {self.workers} workers ({len(syllabi) - len(todo)} skipped)")
+
+        start = time.perf_counter()
+        pending = [] #paths added to the RAGSystem but not embedded yet
+        pending_chunks = 0
+        since_checkpoint = 0
+
+        jobs = ((path, course, self.chunk_size, self.overlap, self.chunker) for path, course in todo)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for result in self._extract_in_order(pool, jobs):
+                if 'error' in result or not result['chunks']:
+                    self.failed[result['path']] = result.get('error', "no text extracted")
+                    print(f"Skipping {result['path']}: {self.failed[result['path']]}")
+                    continue
+
+                self.rag.add_course(result['course'], result['chunks'], pages=result['chunk_pages'],
+                                    sections=result['chunk_sections'])
+                pending.append(result['path'])
+                pending_chunks += len(result['chunks'])
+                self.stats["files"] += 1
+                self.stats["pages"] += result['pages']
+                self.stats["chunks"] += len(result['chunks'])
+
+                if pending_chunks >= self.embed_batch_size:
+                    since_checkpoint += self._embed_pending(pending)
+                    pending, pending_chunks = [], 0
+                    if since_checkpoint >= self.checkpoint_every:
+                        self.checkpoint()
+                        since_checkpoint = 0
+
+        self._embed_pending(pending)
+        if self.rag.index_backend != 'flat' and self.stats["files"]:
+            # indexes were sized and trained on whatever the first batch held, redo them at full size
+            for course, report in self.rag.rebuild_indexes().items():
+                print(f"{course}: {report}")
+        self.checkpoint()
+
+        elapsed = time.perf_counter() - start
+        self.stats["total_seconds"] = elapsed
+        self.stats["pages_per_sec"] = self.stats["pages"] / elapsed if elapsed else 0.0
+        self.stats["chunks_per_sec"] = self.stats["chunks"] / elapsed if elapsed else 0.0
+        if self.rag.near_duplicates is not None:
+            self.stats["dedupe"] = self.rag.dedupe_stats()
+            print(f"Near-duplicate dedupe: {self.stats['dedupe']}")
+        print(f"Ingested {self.stats['files']} syllabi, {self.stats['pages']} pages, {self.stats['chunks']} chunks "
+              f"in {elapsed:.1f}s ({self.stats['pages_per_sec']:.1f} pages/sec, {self.stats['chunks_per_sec']:.1f} chunks/sec)")
+        return self.stats
+
+    def _embed_pending(self, pending):
+        """One large encode call for every chunk added since the last batch"""
+        if not pending:
+            return 0
+        start = time.perf_counter()
+        self.rag.index_chunks()
+        self.stats["embed_seconds"] += time.perf_counter() - start
+        self.done.update(pending)
+        return len(pending)
+
+    def checkpoint(self):
+        """Saves the index, then the list of files it contains"""
+        self.rag.save(self.index_dir)
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": sorted(self.done), "failed": self.failed}, f)
+        os.replace(tmp_path, self.progress_path)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Bulk ingest a directory or JSON manifest of syllabus PDFs")
+    arg_parser.add_argument("source", help="directory of PDFs or manifest.json")
+    arg_parser.add_argument("--out", required=True, help="output directory for the index and checkpoints")
+    arg_parser.add_argument("--workers", type=int, default=None)
+    arg_parser.add_argument("--batch-size", type=int, default=2048, help="chunks per embedding call")
+    arg_parser.add_argument("--checkpoint-every", type=int, default=200, help="syllabi between checkpoints")
+    arg_parser.add_argument("--index-backend", default='flat', choices=['auto', 'flat', 'ivf', 'hnsw', 'ivfpq'])
+    arg_parser.add_argument("--recall-target", type=float, default=0.95)
+    arg_parser.add_argument("--chunker", default='window', choices=['window', 'structured'])
+    arg_parser.add_argument("--max-tokens", type=int, default=200, help="chunk size for the structured chunker")
+    arg_parser.add_argument("--dedupe", action="store_true", help="store and embed near-duplicate boilerplate chunks once")
+    args = arg_parser.parse_args()
+
+    syllabi = find_syllabi(args.source)
+    if not syllabi:
+        print(f"No PDFs found in {args.source}")
+        sys.exit(1)
+
+    # workers count approximate tokens, loading the embedding tokenizer in every process isn't worth it
+    chunker = StructuredChunker(max_tokens=args.max_tokens) if args.chunker == 'structured' else None
+    ingestor = BulkIngestor(args.out, args.workers, args.batch_size, args.checkpoint_every,
+                            index_backend=args.index_backend, recall_target=args.recall_target, chunker=chunker,
+                            dedupe=args.dedupe)
+    ingestor.run(syllabi)
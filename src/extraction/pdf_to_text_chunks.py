@@ -1,46 +1,126 @@
 import pymupdf
 import os
+from collections import deque
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from PDF file"""
+def iter_pdf_pages(pdf_path):
+    """Yields (page_number, text) one page at a time, page numbers start at 1"""
+    doc = pymupdf.open(pdf_path)
     try:
-        text = ""
-        doc = pymupdf.open(pdf_path)
         for page in doc:
-            text += page.get_text()
+            yield page.number + 1, page.get_text()
+    finally:
         doc.close()
-        return text
+
+def extract_text_from_pdf(pdf_path):
+    """Extracts text from PDF file"""
+    try:
+        return "".join(text for _, text in iter_pdf_pages(pdf_path))
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return None
 
+def iter_chunks(pages, chunk_size=600, overlap=50):
+    """Lazily splits (page_number, text) pairs into overlapping chunks of chunk_size words.
+        Only one window of words is held at a time and the overlap carries across page breaks.
+        The last window is only yielded when it has words no earlier chunk had, never as a
+        chunk of nothing but overlap. Yields {'text': chunk, 'pages': [page numbers the chunk spans]}"""
+    window = deque() #(word, page_number)
+    step = chunk_size - overlap
+    fresh = 0 #words in the window that haven't been in a yielded chunk yet
+
+    def make_chunk():
+        return {
+            'text': ' '.join(word for word, _ in window),
+            'pages': list(dict.fromkeys(page for _, page in window))
+        }
+
+    for page_number, text in pages:
+        for word in text.split():
+            window.append((word, page_number))
+            fresh += 1
+            if len(window) == chunk_size:
+                yield make_chunk()
+                fresh = 0
+                for _ in range(step):
+                    window.popleft()
+
+    if fresh:
+        yield make_chunk()
+
 def chunk_text(text, chunk_size=600, overlap=50):
     """Splits text into overlapping chunks"""
-    words = text.split()
-    chunks = []
-    
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        if chunk:
-            chunks.append(chunk)
+    return [chunk['text'] for chunk in iter_chunks([(1, text)], chunk_size, overlap)]
 
-    return chunks
+def stream_syllabus(pdf_path, chunk_size=600, overlap=50):
+    """Streaming version of process_syllabus: yields chunk dicts as pages are parsed,
+        so a consumer can start embedding early chunks before the whole PDF is read"""
+    yield from iter_chunks(iter_pdf_pages(pdf_path), chunk_size, overlap)
 
-def process_syllabus(pdf_path):
-    """Main processing function: Pdf -> text -> chunks"""
+def process_syllabus(pdf_path, chunk_size=600, overlap=50, cache=None, chunker=None):
+    """Main processing function: Pdf -> text -> chunks.
+        chunker (e.g. a StructuredChunker) replaces the fixed word windows of chunk_size/overlap.
+        With a SyllabusCache, a PDF whose bytes were seen before skips extraction entirely"""
     print(f"\nProcessing {pdf_path}:")
+
+    if chunker is not None:
+        chunk_params = chunker.cache_params()
+        make_chunks = chunker.iter_chunks
+    else:
+        # 'window' keys apart from entries cached before the overlap-only last chunk was dropped
+        chunk_params = {'chunker': 'window', 'chunk_size': chunk_size, 'overlap': overlap}
+        make_chunks = lambda pages: iter_chunks(pages, chunk_size, overlap)
+
+    cache_key = None
+    if cache is not None:
+        with open(pdf_path, 'rb') as f:
+            cache_key = cache.make_key(f.read(), **chunk_params)
+        cached = cache.get(cache_key)
+        if cached:
+            print(f"Found {os.path.basename(pdf_path)} in syllabus cache")
+            return {
+                'text': cached['text'],
+                'chunks': cached['chunks'],
+                'chunk_pages': cached.get('chunk_pages'),
+                'chunk_sections': cached.get('chunk_sections'),
+                'chunk_offsets': cached.get('chunk_offsets'),
+                'filename': os.path.basename(pdf_path),
+                'cache_key': cache_key
+            }
     
-    text = extract_text_from_pdf(pdf_path)
+    # pages are kept as a list and joined once, the full text is still needed for the grading parser
+    page_texts = []
+    def read_pages():
+        for page_number, page_text in iter_pdf_pages(pdf_path):
+            page_texts.append(page_text)
+            yield page_number, page_text
+
+    try:
+        chunk_dicts = list(make_chunks(read_pages()))
+    except Exception as e:
+        print(f"Error reading PDF: {e}")
+        return None
+
+    text = "".join(page_texts)
     if not text:
         return None
     
-    chunks = chunk_text(text)
+    chunks = [chunk['text'] for chunk in chunk_dicts]
+    chunk_pages = [chunk['pages'] for chunk in chunk_dicts]
+    # only the structured chunker knows sections and character offsets
+    chunk_sections = [chunk['section'] for chunk in chunk_dicts] if chunker is not None else None
+    chunk_offsets = [[chunk['start'], chunk['end']] for chunk in chunk_dicts] if chunker is not None else None
 
+    if cache is not None:
+        cache.put(cache_key, text, chunks, chunk_pages, chunk_sections, chunk_offsets)
     
     return {
         'text': text,
         'chunks': chunks,
-        'filename': os.path.basename(pdf_path)
+        'chunk_pages': chunk_pages,
+        'chunk_sections': chunk_sections,
+        'chunk_offsets': chunk_offsets,
+        'filename': os.path.basename(pdf_path),
+        'cache_key': cache_key
     }
 
 if __name__ == "__main__":
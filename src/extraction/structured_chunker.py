@@ -0,0 +1,192 @@
+import re
+
+BULLET_PATTERN = re.compile(r"^(?:[•●▪■◦○\-\*–]|o\s|\(?[0-9]{1,2}[.)](?:\s|$)|\(?[a-zA-Z][.)]\s)")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def approx_token_count(text):
+    """Word and punctuation count, a close stand-in for a WordPiece/BPE tokenizer when none is loaded"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def is_heading(line, previous, after_blank=False):
+    """Short capitalised line with no sentence punctuation that follows a blank line or the end of
+        a sentence, table cells ("Attendance", "5%") right after another short line don't count"""
+    words = line.split()
+    if not words or len(words) > 8 or len(line) > 60:
+        return False
+    if line[-1] in ".,;:!?" or '%' in line or not (line[0].isupper() or line[0].isdigit()):
+        return False
+    if BULLET_PATTERN.match(line):
+        return False
+    if previous is None or after_blank:
+        return True
+    return previous[-1] in ".!?*" or len(previous) > 40
+
+
+class StructuredChunker:
+    """Splits syllabus text along its own structure: sections start at headings, bullet items and
+        paragraphs are kept whole where they fit, and anything larger is split at sentence boundaries.
+        Chunk size is measured in tokens of count_tokens (the embedding model's tokenizer in the app)
+        so chunks fit the model's input instead of getting truncated. Each chunk records character
+        offsets into the extracted text, the pages it spans and its section number"""
+
+    def __init__(self, max_tokens=200, min_tokens=40, count_tokens=None, tokenizer_name='approx'):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens #a section smaller than this is merged into the next one
+        self.count_tokens = count_tokens or approx_token_count
+        self.tokenizer_name = tokenizer_name
+
+    def cache_params(self):
+        """Settings that change the chunks, for the syllabus cache key"""
+        return {
+            'chunker': 'structured',
+            'max_tokens': self.max_tokens,
+            'min_tokens': self.min_tokens,
+            'tokenizer': self.tokenizer_name
+        }
+
+    def iter_blocks(self, pages):
+        """Yields {'kind', 'text', 'start', 'end', 'pages'} blocks, where kind is heading, bullet
+            or paragraph and start/end are character offsets into "".join of the page texts.
+            PDF line wraps inside a block are joined with spaces"""
+        block = None
+        previous = None #last non-blank line, for heading detection
+        after_blank = False
+        offset = 0
+
+        for page_number, page_text in pages:
+            for raw_line in page_text.splitlines(keepends=True):
+                line = raw_line.strip()
+                line_start = offset + len(raw_line) - len(raw_line.lstrip())
+                offset += len(raw_line)
+                if not line:
+                    after_blank = True
+                    if block is not None and block['kind'] != 'bullet_marker':
+                        yield block
+                        block = None
+                    continue
+
+                if block is not None and block['kind'] == 'bullet_marker':
+                    # "1." on its own line, the item text follows on the next line
+                    kind = 'bullet'
+                elif is_heading(line, previous, after_blank):
+                    kind = 'heading'
+                elif BULLET_PATTERN.match(line):
+                    kind = 'bullet'
+                else:
+                    kind = None #continues the current block
+
+                if kind == 'bullet' and block is not None and block['kind'] == 'bullet_marker':
+                    block['kind'] = 'bullet'
+                    block['text'] += ' '
+                elif kind is None and block is not None and block['kind'] != 'heading':
+                    block['text'] += ' '
+                else:
+                    if block is not None:
+                        yield block
+                    block = {'kind': kind or 'paragraph', 'text': '', 'start': line_start, 'pages': [], 'anchors': []}
+                    if kind == 'bullet' and len(line.split()) == 1 and line[-1] in '.)':
+                        block['kind'] = 'bullet_marker'
+                block['anchors'].append((len(block['text']), line_start)) #maps block text positions back to the source
+                block['text'] += line
+
+                block['end'] = line_start + len(line)
+                if page_number not in block['pages']:
+                    block['pages'].append(page_number)
+                previous = line
+                after_blank = False
+
+        if block is not None:
+            yield block
+
+    @staticmethod
+    def source_offset(block, position):
+        """Character offset in the source of a position in the block's joined text"""
+        text_start, source_start = next(anchor for anchor in reversed(block['anchors']) if anchor[0] <= position)
+        return source_start + position - text_start
+
+    def split_block(self, block):
+        """Splits a block over max_tokens at sentence boundaries, falling back to words"""
+        pieces = []
+        position = 0
+        for sentence in SENTENCE_END.split(block['text']):
+            sentence_tokens = self.count_tokens(sentence)
+            if sentence_tokens <= self.max_tokens:
+                texts = [(sentence, sentence_tokens)]
+            else:
+                texts = []
+                words, words_tokens = [], 0
+                for word in sentence.split():
+                    word_tokens = self.count_tokens(word)
+                    if words and words_tokens + word_tokens > self.max_tokens:
+                        texts.append((' '.join(words), words_tokens))
+                        words, words_tokens = [], 0
+                    words.append(word)
+                    words_tokens += word_tokens
+                texts.append((' '.join(words), words_tokens))
+
+            for text, piece_tokens in texts:
+                position = max(block['text'].find(text, position), position)
+                pieces.append(dict(
+                    block, text=text, tokens=piece_tokens,
+                    start=self.source_offset(block, position),
+                    end=self.source_offset(block, position + len(text))
+                ))
+                position += len(text)
+        return pieces
+
+    def iter_chunks(self, pages):
+        """Packs blocks into chunks of at most max_tokens that don't cross a section heading
+            (unless the section so far is under min_tokens). A section's heading is repeated at
+            the top of its later chunks so each one says what it's about.
+            Yields {'text', 'pages', 'start', 'end', 'section', 'tokens'}"""
+        parts = [] #blocks in the chunk being built
+        tokens = 0
+        section = 0
+        heading = None #current section's heading block
+        chunk_section = 0
+        chunk_heading = None #heading repeated at the top of the chunk being built
+
+        def make_chunk():
+            text = '\n'.join(part['text'] for part in parts)
+            if chunk_heading is not None:
+                text = chunk_heading['text'] + '\n' + text
+            return {
+                'text': text,
+                'pages': list(dict.fromkeys(page for part in parts for page in part['pages'])),
+                'start': parts[0]['start'],
+                'end': parts[-1]['end'],
+                'section': chunk_section,
+                'tokens': tokens
+            }
+
+        for block in self.iter_blocks(pages):
+            block_tokens = self.count_tokens(block['text'])
+            if block['kind'] == 'heading':
+                section += 1
+                heading = dict(block, tokens=block_tokens)
+                if parts and tokens >= self.min_tokens:
+                    yield make_chunk()
+                    parts, tokens = [], 0
+
+            pieces = [dict(block, tokens=block_tokens)] if block_tokens <= self.max_tokens else self.split_block(block)
+            for piece in pieces:
+                if parts and tokens + piece['tokens'] > self.max_tokens:
+                    yield make_chunk()
+                    parts, tokens = [], 0
+                if not parts:
+                    chunk_section = section
+                    chunk_heading = heading if piece['kind'] != 'heading' else None
+                    if chunk_heading is not None and chunk_heading['tokens'] + piece['tokens'] > self.max_tokens:
+                        chunk_heading = None
+                    tokens = chunk_heading['tokens'] if chunk_heading is not None else 0
+                parts.append(piece)
+                tokens += piece['tokens']
+
+        if parts:
+            yield make_chunk()
+
+    def chunk_text(self, text):
+        return [chunk['text'] for chunk in self.iter_chunks([(1, text)])]
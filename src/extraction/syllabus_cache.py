@@ -0,0 +1,126 @@
+import numpy as np
+import hashlib
+import json
+import shutil
+import threading
+import time
+import os
+
+class SyllabusCache:
+    """Disk cache of processed syllabi keyed by the SHA-256 of the PDF bytes + chunker settings.
+        Holds the extracted text and chunks, plus embeddings per model once they've been computed.
+        Least recently used entries are evicted once the cache grows past max_bytes"""
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._entries = self._read_index() #key -> {"size": bytes on disk, "last_used": timestamp}
+
+    @staticmethod
+    def make_key(pdf_bytes, **chunk_params):
+        """Hash of the file contents and the chunker parameters that produced the chunks"""
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(json.dumps(chunk_params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns {'text', 'chunks', 'chunk_pages', 'chunk_sections', 'chunk_offsets'} for a cached syllabus, or None on a miss"""
+        with self._lock:
+            entry_path = os.path.join(self.cache_dir, key, "result.json")
+            if key not in self._entries or not os.path.exists(entry_path):
+                self.misses += 1
+                return None
+
+            with open(entry_path) as f:
+                result = json.load(f)
+            self.hits += 1
+            self._touch(key)
+            return result
+
+    def put(self, key, text, chunks, chunk_pages=None, chunk_sections=None, chunk_offsets=None):
+        """Stores the extracted text and chunks (and the pages, section and character span of each chunk) for a syllabus"""
+        with self._lock:
+            entry_dir = os.path.join(self.cache_dir, key)
+            os.makedirs(entry_dir, exist_ok=True)
+            with open(os.path.join(entry_dir, "result.json"), "w") as f:
+                json.dump({
+                    "text": text,
+                    "chunks": chunks,
+                    "chunk_pages": chunk_pages,
+                    "chunk_sections": chunk_sections,
+                    "chunk_offsets": chunk_offsets
+                }, f)
+            self._touch(key)
+            self._evict()
+
+    def get_embeddings(self, key, model_name):
+        """Returns the cached float32 embeddings of a syllabus's chunks for model_name, or None"""
+        with self._lock:
+            path = self._embeddings_path(key, model_name)
+            if key not in self._entries or not os.path.exists(path):
+                return None
+            self._touch(key)
+            return np.load(path)
+
+    def put_embeddings(self, key, model_name, embeddings):
+        """Stores chunk embeddings next to an already cached syllabus"""
+        with self._lock:
+            if embeddings is None or key not in self._entries:
+                return False
+            np.save(self._embeddings_path(key, model_name), np.asarray(embeddings, dtype='float32'))
+            self._touch(key)
+            self._evict()
+            return True
+
+    def stats(self):
+        """Hit/miss counters and current size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values())
+            }
+
+    def _embeddings_path(self, key, model_name):
+        safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+        return os.path.join(self.cache_dir, key, f"embeddings_{safe_name}.npy")
+
+    def _touch(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        self._entries[key] = {"size": size, "last_used": time.time()}
+        self._write_index()
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key in sorted(self._entries, key=lambda k: self._entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._entries.pop(key)["size"]
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            print(f"Evicted {key[:12]} from syllabus cache")
+        self._write_index()
+
+    def _read_index(self):
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Syllabus cache index unreadable, starting empty: {e}")
+            return {}
+
+    def _write_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._index_path)
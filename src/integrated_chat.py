@@ -1,23 +1,68 @@
-import anthropic
+import asyncio
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from rag.lexical_index import keywords
+from utils.llm_client import get_llm_client, get_async_llm_client
+from utils.query_resolver import QueryResolver
+from utils.context_builder import ContextBuilder
+from extraction.structured_chunker import approx_token_count
 
 load_dotenv()
 
+SPECULATION_THRESHOLD = 0.6 #keyword overlap between the raw message and the rewritten question to reuse the speculative search
+rewrite_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query-rewrite") # network bound, shared by every chat
+
+
+def question_similarity(message, question, courses):
+    """Jaccard overlap of the two texts' keywords, ignoring course names since the search is
+        already filtered by course and the rewriter mostly just spells those out"""
+    course_tokens = {course.lower() for course in courses}
+    a = set(keywords(message)) - course_tokens
+    b = set(keywords(question)) - course_tokens
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
 
 class RAGChat:
     """Chatbot that can answer syllabus questions, access student's grade info, and give grade advice"""
     
-    def __init__(self, rag_system, grade_calculator, courses):
+    def __init__(self, rag_system, grade_calculator, courses, executor=None, client=None, async_client=None,
+                 answer_cache=None, context_builder=None):
         self.rag = rag_system
         self.courses = courses
         self.calculator = grade_calculator
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        # every chat shares the process-wide clients (and their connections) unless given its own,
+        # e.g. utils.fake_llm.FakeAnthropic to run offline
+        self.client = client or get_llm_client()
+        self.async_client = async_client #an AsyncLLMClient, None for the one on the running event loop
         self.conversation_history = []
-
-    def rewrite_query(self, user_message, courses):
-    
+        self.executor = executor or rewrite_executor
+        self.speculation = {"hits": 0, "misses": 0, "seconds_saved": 0.0}
+        self.last_turn = {} #latest turn: prompt size (prompt_tokens, context, input_tokens) and stream timings (ttft, llm_ttft, total)
+        self.token_usage = {"turns": 0, "prompt_tokens": 0} #running totals of the estimated prompt size
+        self.context_builder = context_builder or ContextBuilder()
+        self.resolver = QueryResolver()
+        self.rewrites = {"local": 0, "llm": 0} #turns resolved by the rules vs sent to the rewriter
+        self.answer_cache = answer_cache #a rag.answer_cache.AnswerCache shared by every chat, None to always generate
+
+    def resolve_locally(self, user_message):
+        """The rule based rewrite when it's confident, otherwise None and the LLM rewriter is needed"""
+        memory = self.resolver.resolve(user_message, self.courses, self.conversation_history)
+        self.rewrites["local" if memory is not None else "llm"] += 1
+        total = self.rewrites["local"] + self.rewrites["llm"]
+        print(f"Query {'resolved locally' if memory is not None else 'sent to the rewriter'}, "
+              f"{self.rewrites['local']}/{total} turns ({self.rewrites['local'] / total:.0%}) skipped the rewriter")
+        return memory
+
+    def llm(self):
+        return self.async_client or get_async_llm_client()
+
+    def rewrite_request(self, user_message, courses):
+        """Arguments of the rewriter's messages.create call"""
         system_prompt = """
             You are a query rewriter agent for a RAG system. 
             Given a user's Chat history, Current query, and Course list, your goal is to return ONLY one valid JSON in this exact format:
@@ -26,10 +71,11 @@ class RAGChat:
                 "question": "rewritten query for RAG retrieval", #you will rewrite the user's current query
                 "courses": ["course1", "course2"], #you will find courses from course list that are relevant to the current query
                 "skip_RAG": false, #false by default
+                "needs_grades": true, #true by default
                 "context_summary": "brief summary of relevant chat history for answering agent"
             }
 
-            Ensure that the following keys are present in output!: ["question", "courses", "skip_RAG", "context_summary"]
+            Ensure that the following keys are present in output!: ["question", "courses", "skip_RAG", "needs_grades", "context_summary"]
 
             Rules For Query Rewriting:
             1. Resolve pronouns/references using chat history and course list (e.g, "it" or "that course" -> "CS316")
@@ -39,6 +85,8 @@ class RAGChat:
             - Current query is completely ambiguous and cannot be resolved (e.g, "What's the policy?" with no context; "My psych class" but 
             user either has no psych classes or more than one psych class)
             - Current query is entirely off-topic (i.e unrelated to academic advise: "What's the weather?", "Help me plan a trip")
+            5. Set needs_grades=false ONLY when the answer comes entirely from the syllabus and doesn't depend on the student's
+            own grades or scores (e.g, late policy, attendance, exam dates, workload). Keep it true when unsure
 
             Rules For Context Summary:
             1. Only include relevant context. Don't summarize entire conversation, just what's needed to answer current question
@@ -59,6 +107,7 @@ class RAGChat:
                 "question": "What is the late submission policy for CS372?",
                 "courses": ["CS372"],
                 "skip_RAG": false,
+                "needs_grades": false,
                 "context_summary": "User previously asked about CS316 late policy for comparison."
             }
 
@@ -73,6 +122,7 @@ class RAGChat:
                 "question": "What is the grading polciy for CS240?",
                 "courses": ["CS240"],
                 "skip_RAG": false,
+                "needs_grades": true,
                 "context_summary": "User got 70% on CS240 midterm and wants to calculate final grade possibilities."
             }
 
@@ -84,6 +134,7 @@ class RAGChat:
                 "question": "What is CS240's attendance policy?",
                 "courses": [],
                 "skip_RAG": True,
+                "needs_grades": false,
                 "context_summary": "User is asking about CS240 but it is not in their course list"
             }
 
@@ -98,6 +149,7 @@ class RAGChat:
                 "question": "What is CS240's drop policy and grading breakdown?",
                 "courses": ["CS372", "CS316", "PSY277"],
                 "skip_RAG": false,
+                "needs_grades": false,
                 "context_summary": "User wants to know workload for their remaining classes. Asked about for CS240 previously."
             }
             """
@@ -111,13 +163,23 @@ class RAGChat:
         Courses: {courses}
         """
 
-        response = self.client.messages.create(
+        return dict(
             model="claude-haiku-4-5-20251001",
             max_tokens=300,  
             system=system_prompt,
             messages=[{"role": "user", "content": user_prompt}]
         )
 
+    def rewrite_query(self, user_message, courses):
+        response = self.client.messages.create(**self.rewrite_request(user_message, courses))
+        return self.read_rewrite(response, user_message)
+
+    async def arewrite_query(self, user_message, courses):
+        response = await self.llm().create(**self.rewrite_request(user_message, courses))
+        return self.read_rewrite(response, user_message)
+
+    def read_rewrite(self, response, user_message):
+        """The rewriter's JSON, or the message as is when it isn't valid"""
         json_text = response.content[0].text.strip()
         
         # AI generated: Claude (123-141)
@@ -136,20 +198,131 @@ class RAGChat:
                 "question": user_message,
                 "courses": None,
                 "skip_RAG": False,
+                "needs_grades": True,
                 "context_summary": ""
             }
         return final_prompt
 
         
     
-    def chat(self, user_message):
-        retrieved_chunks = ""
-        grade_summary = []
-        for course in self.courses:
-            grade_summary.append(self.calculator[course].get_summary())
-        
+    def speculative_retrieve(self, user_message, k=3):
+        """Searches every course with the raw message, returns (results, seconds) or (None, 0) if it fails"""
+        start = time.perf_counter()
+        try:
+            results = self.rag.retrieve(user_message, len(self.courses), self.courses, k=k)
+        except Exception as e:
+            print(f"Speculative retrieval failed: {e}")
+            return None, 0.0
+        return results, time.perf_counter() - start
+
+    def reuse_speculative(self, user_message, memory, speculative):
+        """The speculative results narrowed to the rewriter's courses, or None when the rewriter
+            changed the question too much (or named courses the speculative search didn't cover)"""
+        course_filters = memory.get("courses")
+        if speculative is None or not course_filters:
+            return None
+        known = {course.upper() for course in self.courses}
+        wanted = {course.upper() for course in course_filters}
+        if not wanted <= known:
+            return None
+        if question_similarity(user_message, memory["question"], self.courses) < SPECULATION_THRESHOLD:
+            return None
+        # a filtered search takes k from each course, so the all-course results already hold every one of them
+        return [r for r in speculative if r['course'].upper() in wanted]
+
+    def rewrite_turn(self, user_message):
+        """(memory, speculative results, speculative seconds), memory being the local resolver's
+            rewrite or the LLM rewriter's"""
+        self.last_turn = {}
+        memory = self.resolve_locally(user_message)
+        if memory is not None:
+            return memory, None, 0.0
+
         #for memory & history
-        memory = self.rewrite_query(user_message, self.courses)
+        #the rewriter is a network round trip, so the raw message is embedded and searched while it runs
+        rewrite_future = self.executor.submit(self.rewrite_query, user_message, self.courses)
+        speculative, speculative_seconds = self.speculative_retrieve(user_message)
+        return rewrite_future.result(), speculative, speculative_seconds
+
+    async def arewrite_turn(self, user_message):
+        """rewrite_turn for the event loop: the rewrite is awaited on the shared async client while
+            the speculative search (CPU work) runs on a worker thread"""
+        self.last_turn = {}
+        memory = self.resolve_locally(user_message)
+        if memory is not None:
+            return memory, None, 0.0
+
+        rewrite = asyncio.create_task(self.arewrite_query(user_message, self.courses))
+        speculative, speculative_seconds = await asyncio.to_thread(self.speculative_retrieve, user_message)
+        return await rewrite, speculative, speculative_seconds
+
+    def build_prompt(self, user_message):
+        """Rewrites the query, retrieves syllabus context and returns (system_prompt, user_prompt) for the answer call"""
+        return self.turn_prompts(user_message, *self.rewrite_turn(user_message))
+
+    async def abuild_prompt(self, user_message):
+        memory, speculative, speculative_seconds = await self.arewrite_turn(user_message)
+        return await asyncio.to_thread(self.turn_prompts, user_message, memory, speculative, speculative_seconds)
+
+    def turn_prompts(self, user_message, memory, speculative, speculative_seconds):
+        rag_results = self.retrieve_context(user_message, memory, speculative, speculative_seconds)
+        return self.answer_prompts(user_message, memory, rag_results)
+
+    def chosen_courses(self, memory):
+        """The student's courses the rewriter picked for this turn"""
+        chosen = {course.upper() for course in memory.get("courses") or []}
+        return [course for course in self.courses if course.upper() in chosen]
+
+    def grade_courses(self, memory):
+        """Courses whose grade summaries go into the answer prompt: none when the turn doesn't need
+            grades (a plain syllabus question), otherwise the chosen ones, or all of them when the
+            rewriter named none without skipping RAG (its JSON failed to parse, or a general grade
+            question). A rewrite without needs_grades counts as needing them"""
+        if memory.get("needs_grades", True) is False:
+            return []
+        courses = self.chosen_courses(memory)
+        if not courses and not memory.get("skip_RAG"):
+            courses = self.courses
+        return [course for course in courses if course in self.calculator]
+
+    def cache_lookup(self, memory):
+        """(cache key, cached answer or None) for a rewritten turn, the key is None when the answer
+            can't be cached: no answer cache, nothing retrieved, or the rewriter carried chat history
+            into the prompt. An answer is scoped to the syllabus documents, and when the prompt held
+            grade summaries also to those calculators and their current versions, so answers to
+            syllabus questions (needs_grades false, no grades in the prompt) are shared between students"""
+        document_ids = getattr(self.rag, "document_ids", None) #only a CorpusView knows which syllabus a course is
+        if (self.answer_cache is None or document_ids is None or memory["skip_RAG"] or not memory["courses"]
+                or memory["context_summary"].strip()):
+            return None, None
+        courses = sorted(self.chosen_courses(memory))
+        documents = document_ids(courses)
+        if not courses or None in documents:
+            return None, None
+
+        calculators = [self.calculator[course] for course in self.grade_courses(memory)]
+        scope = ("policy", frozenset(documents))
+        state = None
+        if calculators:
+            scope = ("grades", frozenset(documents), tuple(calculator.uid for calculator in calculators))
+            state = tuple(calculator.version for calculator in calculators)
+
+        embedding = self.rag.embedder.encode_queries([memory["question"]])[0] #the retrieval reuses it from the query cache
+        key = {"scope": scope, "state": state, "embedding": embedding, "question": memory["question"]}
+        hit = self.answer_cache.get(scope, embedding, state)
+        if hit is None:
+            return key, None
+        answer, similarity = hit
+        print(f"Answer cache hit ({scope[0]}, similarity {similarity:.3f}): {self.answer_cache.stats()['hit_rate']:.0%} of lookups hit")
+        return key, answer
+
+    def cache_store(self, key, answer):
+        if key is not None and answer:
+            self.answer_cache.put(key["scope"], key["embedding"], key["question"], answer, key["state"])
+
+    def retrieve_context(self, user_message, memory, speculative, speculative_seconds):
+        """Search results for the rewritten question, reusing the speculative search when it still fits"""
+        rag_results = []
         rag_query = memory["question"]
         course_filters = memory["courses"] 
 
@@ -158,10 +331,25 @@ class RAGChat:
         #print(f"{memory['context_summary']}")
 
         if not memory["skip_RAG"]:
-            rag_results = self.rag.retrieve(rag_query, len(self.courses), course_filters, k=3)
-            retrieved_chunks = "\n\n".join([r['chunk'] for r in rag_results])
-        
-        
+            rag_results = self.reuse_speculative(user_message, memory, speculative)
+            if rag_results is not None:
+                self.speculation["hits"] += 1
+                self.speculation["seconds_saved"] += speculative_seconds
+                print(f"Speculative retrieval reused ({speculative_seconds * 1000:.0f}ms off the critical path)")
+            else:
+                if speculative is not None:
+                    self.speculation["misses"] += 1
+                rag_results = self.rag.retrieve(rag_query, len(self.courses), course_filters, k=3)
+        return rag_results
+
+    def answer_prompts(self, user_message, memory, rag_results):
+        """(system_prompt, user_prompt) for the answer call. The syllabus context is fit into the
+            context builder's token budget, grades are included for the grade_courses() only"""
+        retrieved_chunks, context_stats = self.context_builder.chunk_context(rag_results, memory["question"])
+        grade_summary = []
+        for course in self.grade_courses(memory):
+            grade_summary.append(self.calculator[course].get_summary())
+
         system_prompt =  """You are a friendly and helpful academic advisor for college students at Duke.
        You have access to:
        1. The student's course syllabus
@@ -191,25 +379,45 @@ class RAGChat:
         user_prompt = f"Syllabus contexts:{retrieved_chunks}"
         
         if grade_summary:
-            user_prompt += f"\n Student's current grades: {json.dumps(grade_summary, indent=2)}"
+            user_prompt += f"\n Student's current grades: {self.context_builder.grade_context(grade_summary)}"
 
         user_prompt += f"\n Past Chat Context: {memory['context_summary']} "
         
         user_prompt += f"\n Student question: {user_message}    Answer:"""
-        
 
-        # API call to claude
-        response = self.client.messages.create(
+        prompt_tokens = approx_token_count(system_prompt) + approx_token_count(user_prompt)
+        self.last_turn.update(prompt_tokens=prompt_tokens, context=context_stats)
+        self.token_usage["turns"] += 1
+        self.token_usage["prompt_tokens"] += prompt_tokens
+        print(f"Prompt ~{prompt_tokens} tokens: {context_stats['chunks']} chunks in {context_stats['tokens']}/"
+              f"{self.context_builder.max_context_tokens} context tokens ({context_stats['duplicates']} duplicate, "
+              f"{context_stats['trimmed']} trimmed, {context_stats['dropped']} dropped), grades for {len(grade_summary)} courses")
+        return system_prompt, user_prompt
+
+    def answer_request(self, system_prompt, user_prompt):
+        """Arguments of the answer's messages.create/stream call"""
+        return dict(
             model="claude-haiku-4-5-20251001",
             max_tokens=500,
             system=system_prompt,
             messages=[{"role": "user", "content": user_prompt}]
         )
 
-        print("got final response")
-         
+    def chat(self, user_message):
+        memory, speculative, speculative_seconds = self.rewrite_turn(user_message)
+        cache_key, answer = self.cache_lookup(memory)
+        if answer is None:
+            system_prompt, user_prompt = self.turn_prompts(user_message, memory, speculative, speculative_seconds)
+
+            # API call to claude
+            response = self.client.messages.create(**self.answer_request(system_prompt, user_prompt))
+
+            print("got final response")
+             
 
-        answer = response.content[0].text
+            answer = response.content[0].text
+            self.last_turn["input_tokens"] = response.usage.input_tokens
+            self.cache_store(cache_key, answer)
 
         #print(f"{answer}")
         
@@ -219,6 +427,85 @@ class RAGChat:
         
         return answer
 
+    def chat_stream(self, user_message):
+        """Streaming version of chat: yields the answer so far each time more text arrives.
+            Time to first token (from the start of the turn, and from the answer call alone)
+            is recorded in self.last_turn"""
+        start = time.perf_counter()
+        memory, speculative, speculative_seconds = self.rewrite_turn(user_message)
+        cache_key, answer = self.cache_lookup(memory)
+        if answer is not None:
+            self.last_turn.update(ttft=time.perf_counter() - start, llm_ttft=0.0, cached=True)
+            yield answer
+            self.finish_stream(user_message, answer, start)
+            return
+        system_prompt, user_prompt = self.turn_prompts(user_message, memory, speculative, speculative_seconds)
+
+        answer = ""
+        call_start = time.perf_counter()
+        with self.client.messages.stream(**self.answer_request(system_prompt, user_prompt)) as stream:
+            for text in stream.text_stream:
+                if not answer and text:
+                    now = time.perf_counter()
+                    self.last_turn.update(ttft=now - start, llm_ttft=now - call_start)
+                answer += text
+                yield answer
+            self.last_turn["input_tokens"] = stream.get_final_message().usage.input_tokens
+
+        self.cache_store(cache_key, answer)
+        self.finish_stream(user_message, answer, start)
+
+    def finish_stream(self, user_message, answer, start):
+        self.last_turn["total"] = time.perf_counter() - start
+        print(f"Streamed answer: first token after {self.last_turn.get('ttft', 0):.2f}s "
+              f"({self.last_turn.get('llm_ttft', 0):.2f}s of it the answer call), done in {self.last_turn['total']:.2f}s")
+
+        self.conversation_history.append({"role": "user", "content": user_message})
+        self.conversation_history.append({"role": "assistant", "content": answer})
+
+    async def achat(self, user_message):
+        """chat on the event loop: no thread is held while the rewriter and answer calls are in flight"""
+        memory, speculative, speculative_seconds = await self.arewrite_turn(user_message)
+        cache_key, answer = await asyncio.to_thread(self.cache_lookup, memory)
+        if answer is None:
+            system_prompt, user_prompt = await asyncio.to_thread(
+                self.turn_prompts, user_message, memory, speculative, speculative_seconds
+            )
+            response = await self.llm().create(**self.answer_request(system_prompt, user_prompt))
+            answer = response.content[0].text
+            self.last_turn["input_tokens"] = response.usage.input_tokens
+            self.cache_store(cache_key, answer)
+
+        self.conversation_history.append({"role": "user", "content": user_message})
+        self.conversation_history.append({"role": "assistant", "content": answer})
+        return answer
+
+    async def achat_stream(self, user_message):
+        """Async version of chat_stream, yields the answer so far as it arrives"""
+        start = time.perf_counter()
+        memory, speculative, speculative_seconds = await self.arewrite_turn(user_message)
+        cache_key, answer = await asyncio.to_thread(self.cache_lookup, memory)
+        if answer is not None:
+            self.last_turn.update(ttft=time.perf_counter() - start, llm_ttft=0.0, cached=True)
+            yield answer
+            self.finish_stream(user_message, answer, start)
+            return
+        system_prompt, user_prompt = await asyncio.to_thread(
+            self.turn_prompts, user_message, memory, speculative, speculative_seconds
+        )
+
+        answer = ""
+        call_start = time.perf_counter()
+        async for text in self.llm().stream(**self.answer_request(system_prompt, user_prompt)):
+            if not answer and text:
+                now = time.perf_counter()
+                self.last_turn.update(ttft=now - start, llm_ttft=now - call_start)
+            answer += text
+            yield answer
+
+        self.cache_store(cache_key, answer)
+        self.finish_stream(user_message, answer, start)
+
 
 if __name__ == "__main__":
     import sys
@@ -327,4 +614,5 @@ if __name__ == "__main__":
         print(f"Course Advisor: {answer}")
         print()
 
- 
\ No newline at end of file
+ 
+    print(f"Rewriter calls skipped by the local resolver: {chatbot.rewrites['local']}/{sum(chatbot.rewrites.values())}")
@@ -0,0 +1,93 @@
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+
+class AnswerCache:
+    """Process-wide, thread-safe cache of chat answers looked up by the embedding of the rewritten
+        question. Entries live in a scope: the syllabus documents the answer was retrieved from, plus
+        the grade calculators whose summaries were in the prompt, if any. A lookup hits the most
+        similar entry in its scope at or above threshold, so an answer written without grades is
+        shared by every student with the same syllabus. An entry with grades stores the calculators'
+        versions and is dropped once any of them changes. Entries expire after ttl seconds, the
+        least recently used go first past max_entries"""
+
+    def __init__(self, threshold=0.95, ttl=6 * 3600, max_entries=5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict() #entry id -> {'scope', 'state', 'embedding', 'question', 'answer', 'created', 'hits'}
+        self._scopes = {} #scope -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evicted": 0}
+
+    def _drop(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry['scope']]
+        ids.discard(entry_id)
+        if not ids:
+            del self._scopes[entry['scope']]
+
+    def get(self, scope, embedding, state=None):
+        """(answer, similarity) of the closest live entry in scope, or None"""
+        embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        now = time.monotonic()
+        with self._lock:
+            best, best_similarity = None, self.threshold
+            for entry_id in list(self._scopes.get(scope, ())):
+                entry = self._entries[entry_id]
+                if now - entry['created'] > self.ttl:
+                    self._drop(entry_id)
+                    self.counts["expired"] += 1
+                    continue
+                if entry['state'] != state:
+                    self._drop(entry_id) #the grades it was answered from have changed
+                    self.counts["invalidated"] += 1
+                    continue
+                similarity = float(np.dot(entry['embedding'], embedding))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+
+            if best is None:
+                self.counts["misses"] += 1
+                return None
+            self._entries.move_to_end(best)
+            self._entries[best]['hits'] += 1
+            self.counts["hits"] += 1
+            return self._entries[best]['answer'], best_similarity
+
+    def put(self, scope, embedding, question, answer, state=None):
+        embedding = np.asarray(embedding, dtype='float32')
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'scope': scope,
+                'state': state,
+                'embedding': embedding / (np.linalg.norm(embedding) or 1.0),
+                'question': question,
+                'answer': answer,
+                'created': time.monotonic(),
+                'hits': 0
+            }
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.counts["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return dict(
+                self.counts,
+                hit_rate=self.counts["hits"] / lookups if lookups else 0.0,
+                entries=len(self._entries),
+                scopes=len(self._scopes)
+            )
@@ -0,0 +1,161 @@
+import numpy as np
+import json
+import mmap
+import os
+
+REMOVED = -1 #course id of a removed chunk
+COLUMNS = {'course': 'int32', 'page': 'int32', 'section': 'int32', 'canonical': 'int64'}
+
+
+def column(name):
+    """Property giving the live rows of a preallocated column, writes go through to the buffer"""
+    return property(lambda self: self.columns[name][:self.size])
+
+
+class ChunkTable:
+    """Columnar store for every chunk in a RAGSystem. Course names are interned to int32 ids, and the
+        text of all chunks lives in one UTF-8 buffer addressed by byte offsets, so each chunk costs a few
+        bytes of metadata instead of a Python str plus a list slot. Chunk ids are row numbers and stay
+        stable, removed rows keep their place with course id REMOVED. A near-duplicate row stores no
+        text of its own and points at its canonical row instead.
+        A loaded table can memory-map its text file, chunks are then decoded only when read and
+        every process serving the same index shares those pages through the OS page cache"""
+
+    def __init__(self):
+        self.course_names = [] #course id -> course name
+        self.course_lookup = {} #course name -> course id
+        self.mapped = None #read-only mmap of a saved chunk_text.bin, holds bytes [0, mapped_size)
+        self.mapped_size = 0
+        self.text = bytearray() #bytes added since load, byte offset mapped_size onwards
+        # columns are allocated with room to spare and grow by doubling, rows past size are unused
+        self.size = 0
+        self.offset_buffer = np.zeros(1, dtype='int64')
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    offsets = property(lambda self: self.offset_buffer[:self.size + 1]) #chunk i is text[offsets[i]:offsets[i + 1]]
+    course = column('course')
+    page = column('page') #first page the chunk came from, 0 when unknown
+    section = column('section') #section the chunk came from, -1 when unknown
+    canonical = column('canonical') #row holding this chunk's text and embedding, itself unless a near-duplicate
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, rows):
+        """Makes room for rows chunks, at least doubling the capacity when it runs out so appending
+            costs amortized O(1) per chunk rather than a copy of every column"""
+        capacity = len(self.columns['course'])
+        if rows <= capacity and self.offset_buffer.flags.writeable:
+            return
+        capacity = max(rows, 2 * capacity, 256)
+        for name, values in self.columns.items():
+            grown = np.zeros(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[name] = grown
+        offsets = np.zeros(capacity + 1, dtype='int64')
+        offsets[:self.size + 1] = self.offset_buffer[:self.size + 1] #copies a loaded mmap into memory once
+        self.offset_buffer = offsets
+
+    def __getitem__(self, i):
+        """Chunk text, or None once the chunk has been removed"""
+        if self.course[i] == REMOVED:
+            return None
+        return self.text_of(i)
+
+    def text_of(self, i):
+        """Text of row i's canonical chunk. A canonical row keeps its text after removal,
+            near-duplicates added later may still point at it"""
+        i = self.canonical[i]
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if end <= self.mapped_size:
+            return self.mapped[start:end].decode('utf-8')
+        return self.text[start - self.mapped_size:end - self.mapped_size].decode('utf-8')
+
+    def intern(self, course_name):
+        """Course id for a name, adding it on first use"""
+        if course_name not in self.course_lookup:
+            self.course_lookup[course_name] = len(self.course_names)
+            self.course_names.append(course_name)
+        return self.course_lookup[course_name]
+
+    def append(self, course_name, texts, pages=None, sections=None, canonical=None):
+        """Adds chunks for one course and returns their ids. canonical gives each chunk's canonical
+            row, chunks that aren't their own canonical row don't have their text stored"""
+        course_id = self.intern(course_name)
+        start = len(self)
+        canonical = np.arange(start, start + len(texts), dtype='int64') if canonical is None else np.asarray(canonical, dtype='int64')
+        encoded = [text.encode('utf-8') if canonical[n] == start + n else b"" for n, text in enumerate(texts)]
+
+        lengths = np.fromiter((len(b) for b in encoded), dtype='int64', count=len(encoded))
+        end = start + len(texts)
+        self.reserve(end)
+        self.offset_buffer[start + 1:end + 1] = self.offset_buffer[start] + np.cumsum(lengths)
+        self.text += b"".join(encoded)
+
+        self.columns['course'][start:end] = course_id
+        self.columns['page'][start:end] = pages if pages is not None else 0
+        self.columns['section'][start:end] = sections if sections is not None else -1
+        self.columns['canonical'][start:end] = canonical
+        self.size = end
+        return np.arange(start, end, dtype='int64')
+
+    def course_name(self, i):
+        course_id = self.course[i]
+        return None if course_id == REMOVED else self.course_names[course_id]
+
+    def ids_for_courses(self, course_names, start=0, end=None):
+        """Ids of the live chunks belonging to any of course_names, optionally within [start, end)"""
+        course_ids = [self.course_lookup[name] for name in course_names if name in self.course_lookup]
+        column = self.course[start:end]
+        return np.flatnonzero(np.isin(column, course_ids)).astype('int64') + start
+
+    def live_ids(self, start=0, end=None):
+        return np.flatnonzero(self.course[start:end] != REMOVED).astype('int64') + start
+
+    def owned_ids(self, ids):
+        """The ids among ids that hold their own text, i.e. aren't near-duplicates of another row"""
+        ids = np.asarray(ids, dtype='int64')
+        return ids[self.canonical[ids] == ids]
+
+    def remove(self, ids):
+        self.course[ids] = REMOVED
+
+    def save(self, path):
+        """Writes the text buffer and the columns into an existing directory"""
+        with open(os.path.join(path, "chunk_text.bin"), "wb") as f:
+            if self.mapped is not None:
+                f.write(self.mapped)
+            f.write(self.text)
+        np.save(os.path.join(path, "chunk_offsets.npy"), self.offsets)
+        np.savez(os.path.join(path, "chunk_table.npz"), course=self.course, page=self.page, section=self.section,
+                 canonical=self.canonical)
+        with open(os.path.join(path, "course_names.json"), "w") as f:
+            json.dump(self.course_names, f)
+
+    def text_bytes(self):
+        """(bytes memory-mapped from disk, bytes held in this process)"""
+        return self.mapped_size, len(self.text)
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        """Reads a table written by save(). With use_mmap the text file and offsets are mapped
+            rather than read, so memory stays flat however many chunks the index holds"""
+        table = cls()
+        with open(os.path.join(path, "course_names.json")) as f:
+            table.course_names = json.load(f)
+        table.course_lookup = {name: n for n, name in enumerate(table.course_names)}
+        # course/page/section stay in memory (removal writes to course), offsets are only ever appended to
+        with np.load(os.path.join(path, "chunk_table.npz")) as columns:
+            table.columns = {name: columns[name] for name in COLUMNS}
+        table.size = len(table.columns['course'])
+        table.offset_buffer = np.load(os.path.join(path, "chunk_offsets.npy"), mmap_mode='r' if use_mmap else None)
+
+        text_path = os.path.join(path, "chunk_text.bin")
+        if use_mmap and os.path.getsize(text_path) > 0:
+            with open(text_path, "rb") as f:
+                table.mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            table.mapped_size = len(table.mapped)
+        else:
+            with open(text_path, "rb") as f:
+                table.text = bytearray(f.read())
+        return table
@@ -0,0 +1,100 @@
+"""
+Fixed word windows vs the structured chunker on the bundled syllabi: chunk sizes, how many chunks
+overflow the embedding model's input, prompt tokens RAGChat would send, and whether the passage that
+answers each question is retrieved.
+Run from src/:  python -m rag.chunker_benchmark [syllabus_dir]
+"""
+
+import os
+import sys
+import time
+from extraction.pdf_to_text_chunks import iter_pdf_pages, iter_chunks
+from extraction.structured_chunker import StructuredChunker, approx_token_count
+from .embedding_service import get_embedding_service
+from .rag_system import RAGSystem
+
+# (question, course, phrase from the syllabus that answers it)
+QUESTIONS = [
+    ("What is the late policy for my CS372 class?", "CS372", "cumulative penalty of 3% per day"),
+    ("Does CS372 have a final exam?", "CS372", "no final exam"),
+    ("What is the CS372 collaboration policy?", "CS372", "Collaboration is an encouraged part of the course"),
+    ("How much are homeworks worth in CS316?", "CS316", "Homeworks (25%)"),
+    ("Are the CS316 exams open book?", "CS316", "open-book and open-notes"),
+    ("Are any Gradiance exercises dropped in CS316?", "CS316", "drop your two lowest Gradiance"),
+    ("Is attendance required in CS240?", "CS240", "Attendance is required"),
+    ("How long do I have to request a regrade in CS240?", "CS240", "up to 7 days AFTER"),
+    ("How many exams are there in PSY277?", "PSY277", "three circuit-specific exams"),
+    ("What percentage do I need for an A+ in PSY277?", "PSY277", "A+ 98.00-100%"),
+]
+
+
+def normalized(text):
+    return ' '.join(text.split()).lower()
+
+
+def build(syllabi, make_chunks, embedder):
+    rag = RAGSystem(embedder=embedder)
+    chunks_by_course = {}
+    start = time.perf_counter()
+    for course_name, pages in syllabi:
+        chunks = [chunk['text'] for chunk in make_chunks(pages)]
+        chunks_by_course[course_name] = chunks
+        rag.add_course(course_name, chunks)
+    chunk_seconds = time.perf_counter() - start
+    rag.index_chunks()
+    return rag, chunks_by_course, chunk_seconds
+
+
+def compare(syllabi, embedder=None, max_tokens=200, k=3):
+    """Per chunker: chunk count and token sizes, chunks past the model's max_seq_length,
+        answer recall@k and prompt tokens retrieved per question"""
+    embedder = embedder or get_embedding_service()
+    try:
+        count_tokens = embedder.count_tokens
+        count_tokens("probe")
+        max_seq_length = embedder.model.max_seq_length
+    except AttributeError:
+        count_tokens, max_seq_length = approx_token_count, 256
+
+    chunkers = {
+        'window-600': lambda pages: iter_chunks(pages, 600, 50),
+        f'structured-{max_tokens}': StructuredChunker(max_tokens=max_tokens, count_tokens=count_tokens).iter_chunks,
+    }
+
+    report = {}
+    for name, make_chunks in chunkers.items():
+        rag, chunks_by_course, chunk_seconds = build(syllabi, make_chunks, embedder)
+        sizes = [count_tokens(chunk) for chunks in chunks_by_course.values() for chunk in chunks]
+
+        # one course filtered request per question, as RAGChat does once the rewriter names the course
+        results = rag.retrieve_many([(question, [course], k) for question, course, _ in QUESTIONS])
+        found = sum(any(normalized(phrase) in normalized(r['chunk']) for r in result)
+                    for (_, _, phrase), result in zip(QUESTIONS, results))
+        prompt_tokens = [sum(count_tokens(r['chunk']) for r in result) for result in results]
+
+        report[name] = {
+            "chunks": len(sizes),
+            "mean_tokens": sum(sizes) / len(sizes),
+            "max_tokens": max(sizes),
+            "truncated": sum(size > max_seq_length for size in sizes),
+            f"answer_recall@{k}": found / len(QUESTIONS),
+            "prompt_tokens_per_question": sum(prompt_tokens) / len(prompt_tokens),
+            "chunk_seconds": chunk_seconds
+        }
+    return report
+
+
+if __name__ == "__main__":
+    syllabus_dir = sys.argv[1] if len(sys.argv) > 1 else "../data/duke_syllabi"
+    pdfs = sorted(f for f in os.listdir(syllabus_dir) if f.endswith('.pdf'))
+    if not pdfs:
+        print(f"No PDFs in {syllabus_dir}")
+        sys.exit(1)
+
+    syllabi = [(pdf.split('_')[0].upper(), list(iter_pdf_pages(os.path.join(syllabus_dir, pdf)))) for pdf in pdfs]
+
+    report = compare(syllabi)
+    print(f"\n{'chunker':<16} {'chunks':>6} {'mean tok':>9} {'max tok':>8} {'truncated':>9} {'recall@3':>9} {'prompt tok':>11}")
+    for name, row in report.items():
+        print(f"{name:<16} {row['chunks']:>6} {row['mean_tokens']:>9.1f} {row['max_tokens']:>8} {row['truncated']:>9} "
+              f"{row['answer_recall@3']:>9.2f} {row['prompt_tokens_per_question']:>11.1f}")
@@ -0,0 +1,155 @@
+from sentence_transformers import SentenceTransformer
+import numpy as np
+import threading
+import os
+from .query_cache import QueryEmbeddingCache, normalize_query
+
+BACKENDS = ('torch', 'onnx')
+QUANTIZED_ONNX_FILE = "onnx/model_quint8_avx2.onnx" #dynamic int8 weights, runs on any AVX2 CPU
+
+
+class EmbeddingService:
+    """Wraps one SentenceTransformer so every session in the process can share it.
+        Sessions only keep a reference, copying a session (e.g. gr.State) never copies the model.
+        backend='onnx' runs the same model through ONNX Runtime (quantize=True for dynamic int8),
+        model_path loads the files from a local directory so nothing is downloaded"""
+
+    def __init__(self, model_name='all-MiniLM-L6-v2', query_cache=None, backend='torch', num_threads=None,
+                 model_path=None, quantize=False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend}, expected one of {BACKENDS}")
+        self.model_name = model_name #what the vectors are compatible with, indexes are checked against this
+        self.backend = backend
+        self.num_threads = num_threads
+        self.model_path = model_path
+        self.quantize = quantize
+        # quantized vectors differ slightly, so they get their own query cache entries
+        self.cache_id = model_name if backend == 'torch' else f"{model_name}:onnx{'-qint8' if quantize else ''}"
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache()
+        self._model = None
+        self._lock = threading.Lock() #one forward pass at a time, the runtime already uses all its threads per call
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    print(f"Loading embedding model {self.model_name} ({self.backend})")
+                    self._model = self._load_model()
+                    print("Model loaded!")
+        return self._model
+
+    def _load_model(self):
+        source = self.model_path or self.model_name
+        # a local model directory never touches the network
+        load_kwargs = {"local_files_only": True} if self.model_path and os.path.isdir(self.model_path) else {}
+
+        if self.backend == 'torch':
+            if self.num_threads:
+                import torch
+                torch.set_num_threads(self.num_threads)
+            return SentenceTransformer(source, **load_kwargs)
+
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx embedding backend needs: pip install 'optimum[onnxruntime]'") from e
+
+        session_options = onnxruntime.SessionOptions()
+        if self.num_threads:
+            session_options.intra_op_num_threads = self.num_threads
+        model_kwargs = {"session_options": session_options, "provider": "CPUExecutionProvider"}
+        if self.quantize:
+            model_kwargs["file_name"] = QUANTIZED_ONNX_FILE
+        return SentenceTransformer(source, backend='onnx', model_kwargs=model_kwargs, **load_kwargs)
+
+    def encode(self, texts, show_progress_bar=False):
+        """Returns a float32 matrix with one row per text"""
+        model = self.model
+        with self._lock:
+            embeddings = model.encode(texts, show_progress_bar=show_progress_bar)
+        return np.asarray(embeddings, dtype='float32')
+
+    def count_tokens(self, text):
+        """Number of model tokens in text, without special tokens. The model only sees the first
+            max_seq_length tokens of a chunk, so chunkers size against this"""
+        return len(self.model.tokenizer.tokenize(text))
+
+    def encode_queries(self, questions):
+        """encode() for search queries, going through the query cache so a repeated question
+            skips the forward pass. Misses are encoded together in one call"""
+        keys = [normalize_query(question) for question in questions]
+        embeddings = {}
+        for key in dict.fromkeys(keys):
+            embedding = self.query_cache.get(self.cache_id, key)
+            if embedding is not None:
+                embeddings[key] = embedding
+
+        missing = [key for key in dict.fromkeys(keys) if key not in embeddings]
+        if missing:
+            for key, embedding in zip(missing, self.encode(missing)):
+                self.query_cache.put(self.cache_id, key, embedding)
+                embeddings[key] = embedding
+
+        return np.stack([embeddings[key] for key in keys])
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # unpickling (e.g. in another process) resolves to that process's shared service
+        return (get_embedding_service, (self.model_name, self.backend, self.num_threads, self.model_path, self.quantize))
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+def get_embedding_service(model_name='all-MiniLM-L6-v2', backend='torch', num_threads=None, model_path=None,
+                          quantize=False):
+    """Returns the process-wide EmbeddingService for this model and backend, creating it on first use"""
+    key = (model_name, backend, num_threads, model_path, quantize)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = EmbeddingService(model_name, backend=backend, num_threads=num_threads,
+                                              model_path=model_path, quantize=quantize)
+        return _services[key]
+
+
+def export_onnx_model(model_name_or_path, out_dir, quantize=True):
+    """One-off export of the model to ONNX (plus a dynamic int8 copy) in out_dir,
+        which can then be used offline as EmbeddingService(model_path=out_dir, backend='onnx')"""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(model_name_or_path, backend='onnx')
+    model.save_pretrained(out_dir)
+    if quantize:
+        export_dynamic_quantized_onnx_model(model, 'avx2', out_dir)
+    print(f"Exported {model_name_or_path} to {out_dir}")
+
+
+def parity_check(reference, candidate, texts, queries, k=3):
+    """Checks a candidate backend against the reference (torch) one: cosine similarity of the
+        chunk embeddings, and how many of the reference top-k chunks each query still retrieves"""
+    ref_chunks, cand_chunks = reference.encode(texts), candidate.encode(texts)
+    ref_queries, cand_queries = reference.encode(queries), candidate.encode(queries)
+
+    def normalized(x):
+        return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+    cosine = np.sum(normalized(ref_chunks) * normalized(cand_chunks), axis=1)
+
+    def top_k(query_embeddings, chunk_embeddings):
+        distances = ((query_embeddings[:, None, :] - chunk_embeddings[None, :, :]) ** 2).sum(axis=2)
+        return np.argsort(distances, axis=1)[:, :k]
+
+    ref_top, cand_top = top_k(ref_queries, ref_chunks), top_k(cand_queries, cand_chunks)
+    overlap = np.mean([len(set(r) & set(c)) / len(r) for r, c in zip(ref_top, cand_top)])
+
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        f"top{k}_overlap": float(overlap)
+    }
@@ -0,0 +1,154 @@
+import faiss
+import numpy as np
+
+BACKENDS = ('flat', 'fp16', 'sq8', 'ivf', 'hnsw', 'ivfpq')
+PRECISION_BACKENDS = {'float32': 'flat', 'float16': 'fp16', 'int8': 'sq8'} #exact scans at each storage precision
+FLAT_MAX_VECTORS = 20000 #below this a flat scan is already fast and exact
+HNSW_MAX_VECTORS = 1000000 #HNSW keeps full vectors plus its graph, past this IVF-PQ is the only one that fits in memory
+
+
+def choose_backend(num_vectors, recall_target=0.95):
+    """Picks the cheapest index type expected to reach recall_target for a corpus of num_vectors"""
+    if num_vectors < FLAT_MAX_VECTORS or recall_target >= 0.999:
+        return 'flat'
+    if num_vectors < HNSW_MAX_VECTORS:
+        return 'hnsw' if recall_target >= 0.9 else 'ivf'
+    return 'ivf' if recall_target >= 0.9 else 'ivfpq'
+
+
+def ivf_nlist(num_vectors):
+    """~4*sqrt(n) inverted lists, capped so each list gets at least 39 training points"""
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def pq_params(dimension, num_vectors):
+    """Sub-quantizer count (8 dims each where it divides evenly) and bits per code for IVF-PQ"""
+    m = next((m for m in (dimension // 8, 64, 48, 32, 16, 8) if m and dimension % m == 0), 1)
+    nbits = 8 if num_vectors >= 256 * 39 else max(4, int(np.log2(max(num_vectors // 39, 16))))
+    return m, nbits
+
+
+def can_train(backend, num_vectors, dimension):
+    """Whether num_vectors are enough to train backend usefully: IVF needs at least 2 lists of 39
+        points each (one list is a flat scan with extra steps), PQ also 2**nbits points per codebook"""
+    if backend not in ('ivf', 'ivfpq'):
+        return True
+    nlist = ivf_nlist(num_vectors)
+    if nlist < 2:
+        return False
+    needed = 39 * nlist
+    if backend == 'ivfpq':
+        _, nbits = pq_params(dimension, num_vectors)
+        needed = max(2 ** nbits, needed)
+    return num_vectors >= needed
+
+
+def make_base_index(backend, embeddings):
+    """Creates (and trains if needed) an empty index of the given backend, sized for embeddings"""
+    num_vectors, dimension = embeddings.shape
+    if backend == 'flat':
+        return faiss.IndexFlatL2(dimension)
+    if backend == 'fp16':
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+    if backend == 'sq8':
+        # trained on a fixed [-bound, bound] range rather than the first batch's min/max, which later
+        # chunks would be clipped to. Normalized embeddings (MiniLM's are) never leave [-1, 1]
+        bound = max(1.0, float(np.abs(embeddings).max())) if num_vectors else 1.0
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+        index.train(np.array([[-bound] * dimension, [bound] * dimension], dtype='float32'))
+        return index
+    if backend == 'hnsw':
+        return faiss.IndexHNSWFlat(dimension, 32)
+
+    nlist = ivf_nlist(num_vectors)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if backend == 'ivf':
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    elif backend == 'ivfpq':
+        m, nbits = pq_params(dimension, num_vectors)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, nbits)
+    else:
+        raise ValueError(f"Unknown index backend {backend}, expected one of {BACKENDS} or 'auto'")
+
+    print(f"Training {backend} index on {num_vectors} vectors ({nlist} lists)")
+    index.train(embeddings)
+    return index
+
+
+def build_index(embeddings, ids, backend='auto', recall_target=0.95, k=10, precision='float32'):
+    """Builds an IDMap2-wrapped index over embeddings with our chunk ids. For approximate backends
+        the search parameter (nprobe / efSearch) is tuned until recall@k against a flat scan reaches
+        recall_target. precision (float32, float16 or int8) swaps a flat index for the matching
+        scalar quantized one. Returns (index, report) where report has the backend, setting and recall"""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    if backend == 'auto':
+        backend = choose_backend(len(embeddings), recall_target)
+    if not can_train(backend, *embeddings.shape):
+        # e.g. a course's first batch of chunks, rebuild_indexes trains the real backend once there's enough
+        print(f"Only {len(embeddings)} vectors, too few to train {backend}, using a flat index")
+        backend = 'flat'
+    if backend == 'flat':
+        backend = PRECISION_BACKENDS[precision]
+
+    index = faiss.IndexIDMap2(make_base_index(backend, embeddings))
+    index.add_with_ids(embeddings, ids)
+
+    report = {'backend': backend, 'num_vectors': len(embeddings)}
+    if backend in ('ivf', 'hnsw', 'ivfpq'):
+        report.update(tune_search(index, embeddings, ids, recall_target, k))
+    return index, report
+
+
+def base_index(index):
+    """The index inside an IDMap wrapper, as its concrete type"""
+    return faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+
+
+def set_search_param(index, value):
+    """Sets nprobe (IVF) or efSearch (HNSW) on an index, looking through the IDMap wrapper.
+        Returns (parameter name, value actually applied)"""
+    base = base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = value
+        return 'efSearch', value
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(value, base.nlist)
+        return 'nprobe', base.nprobe
+    return None, None
+
+
+def measure_recall(index, embeddings, ids, queries, k=10):
+    """recall@k of index against an exact flat scan of the same embeddings"""
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    k = min(k, len(embeddings))
+    _, truth = flat.search(queries, k)
+    _, found = index.search(queries, k)
+
+    truth_ids = ids[truth]
+    matched = sum(len(set(t) & set(f)) for t, f in zip(truth_ids, found))
+    return matched / truth_ids.size
+
+
+def tune_search(index, embeddings, ids, recall_target=0.95, k=10, num_queries=200):
+    """Raises nprobe/efSearch until recall@k on a sample of the corpus reaches recall_target"""
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    # small noise so a query isn't trivially its own nearest neighbour
+    queries = embeddings[sample] + rng.normal(0, 0.01, size=(len(sample), embeddings.shape[1])).astype('float32')
+
+    if isinstance(base_index(index), faiss.IndexHNSW):
+        candidates = (16, 32, 64, 128, 256, 512, 1024) #efSearch below k is meaningless
+    else:
+        candidates = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+    for value in candidates:
+        param, applied = set_search_param(index, value)
+        recall = measure_recall(index, embeddings, ids, queries, k)
+        if recall >= recall_target or applied < value: #stop once nprobe already covers every list
+            break
+    value = applied
+
+    print(f"Tuned {param}={value}: recall@{k} {recall:.3f} (target {recall_target})")
+    return {'param': param, 'value': value, f'recall@{k}': recall}
@@ -0,0 +1,74 @@
+import math
+import re
+from array import array
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "for", "in", "on", "to", "is", "are", "was", "be", "it", "its",
+    "my", "i", "me", "do", "does", "what", "which", "how", "when", "who", "can", "about", "this", "that",
+    "with", "at", "by", "from", "as", "there", "their", "they", "you", "your", "any", "have", "has", "s"
+}
+
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens, so course codes like PSY277 and numbers like "midterm 2" survive"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def keywords(text):
+    return [token for token in dict.fromkeys(tokenize(text)) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Small inverted index with BM25 scoring. Postings are packed int arrays (chunk ids, term counts),
+        and idf is worked out at query time so chunks can keep being added"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {} #token -> (array of chunk ids, array of term counts)
+        self.doc_lengths = {} #chunk id -> number of tokens
+        self.total_length = 0
+
+    def add(self, ids, texts):
+        for chunk_id, text in zip(ids, texts):
+            tokens = tokenize(text)
+            self.doc_lengths[int(chunk_id)] = len(tokens)
+            self.total_length += len(tokens)
+            for token, count in Counter(tokens).items():
+                if token not in self.postings:
+                    self.postings[token] = (array('q'), array('i'))
+                ids_list, counts = self.postings[token]
+                ids_list.append(int(chunk_id))
+                counts.append(count)
+
+    def search(self, query, k):
+        """Returns up to k (score, chunk id, number of query keywords matched) best first"""
+        terms = [term for term in keywords(query) if term in self.postings]
+        if not terms or not self.doc_lengths:
+            return []
+
+        num_docs = len(self.doc_lengths)
+        avg_length = self.total_length / num_docs
+        scores = {}
+        matched = Counter()
+        for term in terms:
+            ids_list, counts = self.postings[term]
+            idf = math.log(1 + (num_docs - len(ids_list) + 0.5) / (len(ids_list) + 0.5))
+            for chunk_id, count in zip(ids_list, counts):
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (self.k1 + 1) / (count + norm)
+                matched[chunk_id] += 1
+
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(score, chunk_id, matched[chunk_id]) for chunk_id, score in best]
+
+
+def reciprocal_rank_fusion(rankings, c=60):
+    """Fuses ranked lists of ids into {id: score}, each list adding 1 / (c + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (c + rank)
+    return scores
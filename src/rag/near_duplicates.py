@@ -0,0 +1,83 @@
+import numpy as np
+import zlib
+from .lexical_index import tokenize
+
+PRIME = 4294967291 #largest prime below 2^32, shingle hashes are crc32 so (a * x + b) fits in uint64
+
+
+def shingles(text, size=3):
+    """Overlapping word n-grams, so reflowed or re-chunked copies of a paragraph still overlap"""
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHashIndex:
+    """MinHash signatures with LSH banding for finding near-duplicate chunks (boilerplate like the
+        community standard or accessibility paragraphs) across every syllabus in a RAGSystem.
+        Two chunks are near-duplicates when their estimated shingle Jaccard similarity is at least
+        threshold, candidates are the chunks sharing any band of the signature"""
+
+    def __init__(self, num_perm=64, bands=16, threshold=0.8, seed=1):
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype='uint64')
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype='uint64')
+        self.signatures = {} #chunk id -> signature
+        self.buckets = {} #(band, band bytes) -> [chunk ids]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        """num_perm minimum hashes of the text's shingles, None for text without any words"""
+        hashes = np.array([zlib.crc32(shingle.encode()) % PRIME for shingle in shingles(text)], dtype='uint64')
+        if not len(hashes):
+            return None
+        permuted = (hashes[:, None] * self.a + self.b) % np.uint64(PRIME)
+        return permuted.min(axis=0).astype('uint32')
+
+    def band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def find(self, text, signature=None):
+        """Id of the most similar indexed chunk at or above threshold, or None"""
+        signature = self.signature(text) if signature is None else signature
+        if signature is None:
+            return None
+        candidates = dict.fromkeys(i for key in self.band_keys(signature) for i in self.buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for i in candidates:
+            similarity = np.mean(self.signatures[i] == signature)
+            if similarity >= best_similarity:
+                best, best_similarity = i, similarity
+        return best
+
+    def add(self, chunk_id, text, signature=None):
+        signature = self.signature(text) if signature is None else signature
+        if signature is None:
+            return
+        self.signatures[chunk_id] = signature
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, []).append(chunk_id)
+
+    def find_or_add(self, chunk_id, text):
+        """The canonical id for a new chunk: an existing near-duplicate's id, or chunk_id after adding it"""
+        signature = self.signature(text)
+        match = self.find(text, signature)
+        if match is not None:
+            return match
+        self.add(chunk_id, text, signature)
+        return chunk_id
+
+    def remove(self, chunk_id):
+        signature = self.signatures.pop(chunk_id, None)
+        if signature is None:
+            return
+        for key in self.band_keys(signature):
+            self.buckets[key].remove(chunk_id)
+            if not self.buckets[key]:
+                del self.buckets[key]
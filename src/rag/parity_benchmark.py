@@ -0,0 +1,39 @@
+"""
+Embedding parity of the ONNX Runtime backend (plain and int8 quantized) against torch on the bundled syllabi.
+Run from src/:  python -m rag.parity_benchmark [syllabus_dir] [model_path]
+Needs onnxruntime and optimum installed, model_path is a directory from export_onnx_model() for the ONNX side
+"""
+
+import os
+import sys
+from extraction.pdf_to_text_chunks import process_syllabus
+from .embedding_service import get_embedding_service, parity_check
+from .precision_benchmark import QUESTIONS
+
+CANDIDATES = {'onnx': dict(backend='onnx'), 'onnx-int8': dict(backend='onnx', quantize=True)}
+
+
+def compare(texts, queries, model_path=None, k=3):
+    """parity_check of each ONNX variant against torch over texts, retrieving for queries"""
+    reference = get_embedding_service()
+    return {name: parity_check(reference, get_embedding_service(model_path=model_path, **options), texts, queries, k)
+            for name, options in CANDIDATES.items()}
+
+
+if __name__ == "__main__":
+    syllabus_dir = sys.argv[1] if len(sys.argv) > 1 else "../data/duke_syllabi"
+    model_path = sys.argv[2] if len(sys.argv) > 2 else None
+    pdfs = sorted(f for f in os.listdir(syllabus_dir) if f.endswith('.pdf'))
+    if not pdfs:
+        print(f"No PDFs in {syllabus_dir}")
+        sys.exit(1)
+
+    texts = []
+    for pdf in pdfs:
+        texts += process_syllabus(os.path.join(syllabus_dir, pdf))['chunks']
+
+    report = compare(texts, QUESTIONS, model_path)
+    print(f"\n{len(texts)} chunks, {len(QUESTIONS)} queries")
+    print(f"{'backend':<10} {'min cosine':>11} {'mean cosine':>12} {'top3 overlap':>13}")
+    for name, row in report.items():
+        print(f"{name:<10} {row['min_cosine']:>11.4f} {row['mean_cosine']:>12.4f} {row['top3_overlap']:>13.3f}")
@@ -0,0 +1,75 @@
+"""
+Recall and memory of float16 / int8 embedding storage against float32 on the bundled syllabi.
+Run from src/:  python -m rag.precision_benchmark [syllabus_dir]
+"""
+
+import faiss
+import os
+import sys
+from extraction.pdf_to_text_chunks import process_syllabus
+from .rag_system import RAGSystem
+
+QUESTIONS = [
+    "What is the late policy for my CS240 class?",
+    "Which of my classes have finals?",
+    "Which of my course policy is stricter? CS240 or PSY277?",
+    "Which class seems the easiest to get an A?",
+    "Summarize the sylabus for CS240, what are they key things I need to know?",
+    "What is the late submission policy for CS372?",
+    "How are exams weighted in PSY277 and CS372?",
+    "What's the attendance policy for CS316?",
+    "Does CS372 allow collaboration on homework?",
+    "Which courses have group projects?",
+]
+
+
+def build(syllabi, precision, embedder=None):
+    rag = RAGSystem(embedder=embedder, precision=precision)
+    for course_name, chunks in syllabi:
+        rag.add_course(course_name, chunks)
+    rag.index_chunks()
+    return rag
+
+
+def index_bytes(rag):
+    return sum(faiss.serialize_index(index).nbytes for index in rag.course_indexes.values())
+
+
+def compare(syllabi, k=3):
+    """recall@k of each precision against float32, per question and per course, plus index/matrix memory"""
+    rags = {precision: build(syllabi, precision) for precision in ('float32', 'float16', 'int8')}
+    courses = list(rags['float32'].course_indexes)
+
+    requests = [(question, [course], k) for question in QUESTIONS for course in courses]
+    requests += [(question, None, k) for question in QUESTIONS]
+    truth = rags['float32'].retrieve_many(requests)
+
+    report = {}
+    for precision, rag in rags.items():
+        found = rag.retrieve_many(requests)
+        matched = sum(len({r['chunk'] for r in t} & {r['chunk'] for r in f}) for t, f in zip(truth, found))
+        total = sum(len(t) for t in truth)
+        report[precision] = {
+            f"recall@{k}": matched / total if total else 1.0,
+            "index_bytes": index_bytes(rag),
+            "embedding_matrix_bytes": rag.embeddings.nbytes
+        }
+    return report
+
+
+if __name__ == "__main__":
+    syllabus_dir = sys.argv[1] if len(sys.argv) > 1 else "../data/duke_syllabi"
+    pdfs = sorted(f for f in os.listdir(syllabus_dir) if f.endswith('.pdf'))
+    if not pdfs:
+        print(f"No PDFs in {syllabus_dir}")
+        sys.exit(1)
+
+    syllabi = []
+    for pdf in pdfs:
+        result = process_syllabus(os.path.join(syllabus_dir, pdf))
+        syllabi.append((pdf.split('_')[0].upper(), result['chunks']))
+
+    report = compare(syllabi)
+    print(f"\n{'precision':<10} {'recall@3':>9} {'index bytes':>12} {'matrix bytes':>13}")
+    for precision, row in report.items():
+        print(f"{precision:<10} {row['recall@3']:>9.3f} {row['index_bytes']:>12} {row['embedding_matrix_bytes']:>13}")
@@ -0,0 +1,82 @@
+import numpy as np
+import threading
+import os
+from collections import OrderedDict
+
+def normalize_query(text):
+    """MiniLM's tokenizer is uncased and ignores repeated whitespace, so this doesn't change the embedding"""
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """Bounded, thread-safe LRU cache of query embeddings keyed by (model name, normalized query).
+        With a path it is loaded on creation and written back by save()"""
+
+    def __init__(self, max_entries=10000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def get(self, model_name, text):
+        key = (model_name, normalize_query(text))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, model_name, text, embedding):
+        key = (model_name, normalize_query(text))
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries)
+            }
+
+    def save(self, path=None):
+        """Writes the cache to an .npz file (least recently used first, so load keeps the order)"""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            if not self._entries:
+                return
+            keys = list(self._entries.keys())
+            embeddings = np.stack(list(self._entries.values()))
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path,
+                 model_names=np.array([model_name for model_name, _ in keys]),
+                 queries=np.array([query for _, query in keys]),
+                 embeddings=embeddings)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        try:
+            with np.load(path) as stored:
+                entries = zip(stored["model_names"].tolist(), stored["queries"].tolist(), stored["embeddings"])
+                with self._lock:
+                    for model_name, query, embedding in entries:
+                        self._entries[(model_name, query)] = np.array(embedding, dtype='float32')
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            print(f"Loaded {len(self._entries)} cached query embeddings from {path}")
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Query embedding cache unreadable, starting empty: {e}")
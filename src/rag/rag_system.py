@@ -1,86 +1,509 @@
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+import json
+import shutil
 import sys
 import os
 
+if __name__ == "__main__" and not __package__:
+    # run as a script (python src/rag/rag_system.py), the relative imports below go through the rag package
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    __package__ = "rag"
+
+from .embedding_service import get_embedding_service
+from .index_factory import build_index
+from .lexical_index import BM25Index, keywords, reciprocal_rank_fusion
+from .chunk_table import ChunkTable
+from .near_duplicates import MinHashIndex
+
+INDEX_FORMAT_VERSION = 5
+MAX_CHUNKS_PER_COURSE = 3
+HYBRID_DEPTH = 2 #each leg of hybrid search ranks this many times the per-course quota before fusing
+
 class RAGSystem:
-    def __init__(self):
-        print("Loading embedding model")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.chunks = [] #holds chunks from all syllabi
-        self.chunk_metadata = [] #holds corresponding course name of chunks in self.chunks[]
-        self.index = None
-        print("Model loaded!")
-
-    def add_course(self, course_name, chunks):
-        """Place all chunks from all syllabi in self.chunks[] and build
-            Parallel list of corresponding course names"""
+    def __init__(self, model_name='all-MiniLM-L6-v2', embedder=None, index_backend='flat', recall_target=0.95,
+                 precision='float32', hybrid=False, dedupe=False):
+        # shared across sessions, the model itself loads on first encode so a reloaded index can serve right away
+        self.embedder = embedder or get_embedding_service(model_name)
+        self.model_name = self.embedder.model_name
+        self.table = ChunkTable() #chunks from all syllabi with their course/page/section columns, row number is the chunk id
+        self.embeddings = None #row i is the embedding of chunk id i, float16 unless precision is float32
+        self.precision = precision #float32, float16 or int8 (scalar quantized) storage for flat course indexes
+        self.num_indexed = 0 #chunk ids below this have already been embedded and added to an index
+        self.course_indexes = {} #course name -> its own FAISS index, so filtered search only scans those courses
+        self.index_backend = index_backend #flat, ivf, hnsw, ivfpq or auto (picked per course from its size)
+        self.recall_target = recall_target
+        self.index_reports = {} #course name -> backend, tuned search setting and measured recall
+        self.precomputed = {} #chunk id -> embedding handed in with add_course, used instead of encoding
+        self.hybrid = hybrid #also keep a BM25 index per course and fuse it with the dense results
+        self.lexical_indexes = {} #course name -> BM25Index over that course's chunks
+        self.lexical_only_queries = 0 #hybrid queries where the keyword hits were good enough to skip dense search
+        # near-duplicate chunks (shared boilerplate) are stored, embedded and indexed once under their first copy
+        self.near_duplicates = MinHashIndex() if dedupe else None
+        self.borrowed = {} #course name -> canonical chunk ids of other courses that its near-duplicates point at
+
+    @property
+    def embeddings(self):
+        """The embedded rows of a buffer that grows by doubling, rows past them are unused"""
+        if self.embedding_buffer is None:
+            return None
+        return self.embedding_buffer[:self.num_embedded]
+
+    @embeddings.setter
+    def embeddings(self, matrix):
+        self.embedding_buffer = matrix
+        self.num_embedded = 0 if matrix is None else len(matrix)
+
+    def append_embeddings(self, rows):
+        """Adds rows after the last embedding. The buffer is only reallocated, at double its size,
+            when it runs out of room (or is a read-only mmap), so indexing in small batches doesn't
+            copy the whole matrix each time"""
+        end = self.num_embedded + len(rows)
+        buffer = self.embedding_buffer
+        if buffer is None or end > len(buffer) or not buffer.flags.writeable:
+            capacity = max(end, 2 * (len(buffer) if buffer is not None else 0), 256)
+            grown = np.zeros((capacity, rows.shape[1]), dtype=rows.dtype)
+            if buffer is not None:
+                grown[:self.num_embedded] = buffer[:self.num_embedded]
+            self.embedding_buffer = grown
+        self.embedding_buffer[self.num_embedded:end] = rows
+        self.num_embedded = end
+
+    @property
+    def chunks(self):
+        """Chunk texts by id (None once removed), indexable like the old list"""
+        return self.table
+
+    @property
+    def chunk_metadata(self):
+        """Course name of every chunk id, built from the table's course column"""
+        return [self.table.course_name(i) for i in range(len(self.table))]
+
+    def add_course(self, course_name, chunks, embeddings=None, pages=None, sections=None):
+        """Place all chunks from all syllabi in the chunk table tagged with their course
+            (and page / section when known).
+            embeddings (e.g. from the syllabus cache) lets index_chunks skip encoding these chunks.
+            With dedupe on, a near-duplicate of a chunk already stored only points at that chunk"""
         print(f"Adding in chunks from {course_name} and making parallel meta data entries")
-        for chunk in chunks:
-            self.chunks.append(chunk)
-            self.chunk_metadata.append(course_name.upper())
-    
+        if embeddings is not None and len(embeddings) != len(chunks):
+            print(f"Ignoring {len(embeddings)} cached embeddings for {len(chunks)} chunks")
+            embeddings = None
+
+        canonical = None
+        if self.near_duplicates is not None:
+            start = len(self.table)
+            canonical = [self.near_duplicates.find_or_add(start + n, chunk) for n, chunk in enumerate(chunks)]
+
+        ids = self.table.append(course_name.upper(), chunks, pages, sections, canonical)
+        if embeddings is not None:
+            self.precomputed.update((i, embeddings[i - ids[0]]) for i in self.table.owned_ids(ids).tolist())
+
+    def get_course_ids(self, course_name, indexed_only=False):
+        """Returns the chunk ids that currently belong to a course"""
+        return self.table.ids_for_courses([course_name.upper()], end=self.num_indexed if indexed_only else None)
+
+    def get_course_embeddings(self, course_name, texts=None):
+        """Returns the embedding matrix of a course's indexed chunks, in chunk order. A near-duplicate
+            row gets its canonical chunk's vector, unless texts (the course's chunks in order) are given,
+            then it's encoded from its own text, as the cache of a syllabus's embeddings needs.
+            None when texts don't line up with the course's chunks"""
+        ids = self.get_course_ids(course_name, indexed_only=True)
+        if not len(ids) or self.embeddings is None:
+            return None
+        embeddings = np.asarray(self.embeddings[self.table.canonical[ids]], dtype='float32')
+        if texts is None:
+            return embeddings
+        if len(texts) != len(ids):
+            return None
+        duplicates = np.flatnonzero(self.table.canonical[ids] != ids)
+        if len(duplicates):
+            embeddings[duplicates] = self.embedder.encode([texts[n] for n in duplicates.tolist()])
+        return embeddings
+
+    @property
+    def index(self):
+        """True-ish once at least one course has been indexed"""
+        return self.course_indexes or self.borrowed or None
+
+    def searchable_courses(self):
+        """Courses with something to search: their own index and/or near-duplicates of other courses' chunks"""
+        return dict.fromkeys(list(self.course_indexes) + list(self.borrowed))
+
+    def dedupe_stats(self):
+        """Live chunks vs the chunks actually stored and embedded once near-duplicates share one copy"""
+        live = self.table.live_ids()
+        stored = len(np.unique(self.table.canonical[live]))
+        return {
+            "chunks": len(live),
+            "stored_chunks": stored,
+            "near_duplicates": len(live) - len(self.table.owned_ids(live)),
+            "dedupe_ratio": len(live) / stored if stored else 1.0
+        }
+
+    def remove_course(self, course_name):
+        """Drops a course's chunks and its index without re-embedding anything else.
+            Removed ids are left as None so every other chunk id stays the same"""
+        ids = self.get_course_ids(course_name)
+        if not len(ids):
+            print(f"{course_name} has no chunks to remove")
+            return False
+
+        self.course_indexes.pop(course_name.upper(), None)
+        self.index_reports.pop(course_name.upper(), None)
+        self.lexical_indexes.pop(course_name.upper(), None)
+        self.borrowed.pop(course_name.upper(), None)
+
+        self.table.remove(ids)
+        # canonical chunks that other courses' near-duplicates still point at keep their embedding and dedupe entry
+        referenced = set(self.table.canonical[self.table.live_ids()].tolist())
+        for i in ids.tolist():
+            if i not in referenced:
+                self.precomputed.pop(i, None)
+                if self.near_duplicates is not None:
+                    self.near_duplicates.remove(i)
+
+        print(f"Removed {len(ids)} chunks from {course_name}")
+        return True
+
+    def replace_course(self, course_name, chunks):
+        """Swaps a course's chunks for new ones (e.g. a re-uploaded syllabus), only the new chunks get embedded"""
+        self.remove_course(course_name)
+        self.add_course(course_name, chunks)
+        self.index_chunks()
+
     def index_chunks(self):
-        """Creates embeddings and FAISS index for all chunks across all syllabi"""
-        print(f"Creating embeddings for {len(self.chunks)} chunks")
-        
-        embeddings = self.model.encode(self.chunks, show_progress_bar=True)
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings.astype('float32'))
-        
-        print(f"Indexed {len(self.chunks)} chunks!")
+        """Creates embeddings for chunks added since the last call and appends them to their course's FAISS index.
+            A near-duplicate isn't encoded or indexed again, its course searches the canonical chunk's embedding"""
+        new_ids = self.table.live_ids(start=self.num_indexed)
+        if not len(new_ids):
+            self.num_indexed = len(self.table)
+            print("No new chunks to index")
+            return
+
+        canonical = self.table.canonical[new_ids]
+        owned = new_ids[canonical == new_ids]
+        # a near-duplicate can point at a chunk whose course was removed before it was ever embedded
+        unembedded = canonical[(canonical != new_ids) & (canonical >= self.num_indexed)]
+        embed_ids = np.union1d(owned, unembedded).astype('int64')
+
+        to_encode = [i for i in embed_ids.tolist() if i not in self.precomputed]
+        print(f"Creating embeddings for {len(to_encode)} new chunks ({len(embed_ids) - len(to_encode)} already embedded, "
+              f"{len(new_ids) - len(owned)} near-duplicates)")
+
+        encoded = {}
+        if to_encode:
+            vectors = self.embedder.encode([self.table.text_of(i) for i in to_encode], show_progress_bar=True)
+            encoded = dict(zip(to_encode, vectors))
+        embed_vectors = np.array([encoded[i] if i in encoded else self.precomputed[i] for i in embed_ids.tolist()],
+                                 dtype='float32')
+        dimension = self.embeddings.shape[1] if self.embeddings is not None else embed_vectors.shape[1]
+
+        # rows for chunks removed before they were ever indexed, and for near-duplicates, stay zero
+        storage_dtype = 'float32' if self.precision == 'float32' else 'float16'
+        rows = np.zeros((len(self.table) - self.num_indexed, dimension), dtype=storage_dtype)
+        if len(embed_ids):
+            rows[embed_ids - self.num_indexed] = embed_vectors
+
+        # new courses' indexes are built before any existing index is touched, and the embeddings,
+        # precomputed vectors and num_indexed only change once every FAISS add has gone through,
+        # so a failed call can be retried without row i of the embeddings drifting from chunk id i
+        owned_vectors = embed_vectors[np.isin(embed_ids, owned)]
+        owned_courses = self.table.course[owned]
+        built = {}
+        for course_id in dict.fromkeys(owned_courses.tolist()):
+            course = self.table.course_names[course_id]
+            in_course = owned_courses == course_id
+            if course not in self.course_indexes:
+                # IDMap keeps our chunk ids as the FAISS ids, so results map straight back to self.chunks.
+                # approximate backends train on the course's first batch, later chunks are just added
+                built[course] = build_index(owned_vectors[in_course], owned[in_course], self.index_backend,
+                                            self.recall_target, precision=self.precision)
+        for course_id in dict.fromkeys(owned_courses.tolist()):
+            course = self.table.course_names[course_id]
+            if course not in built:
+                in_course = owned_courses == course_id
+                self.course_indexes[course].add_with_ids(owned_vectors[in_course], owned[in_course])
+        for course, (index, report) in built.items():
+            self.course_indexes[course], self.index_reports[course] = index, report
+
+        self.append_embeddings(rows)
+        for i in embed_ids.tolist():
+            self.precomputed.pop(i, None)
+        self.add_borrowed(new_ids)
+
+        if self.hybrid:
+            new_courses = self.table.course[new_ids]
+            for course_id in dict.fromkeys(new_courses.tolist()):
+                self.add_lexical(self.table.course_names[course_id], new_ids[new_courses == course_id])
+        self.num_indexed = len(self.table)
+
+        total = sum(index.ntotal for index in self.course_indexes.values())
+        print(f"Indexed {len(new_ids)} chunks! ({total} total across {len(self.course_indexes)} courses)")
+
+    def add_borrowed(self, ids):
+        """Records, for each course, the canonical chunks of other courses its near-duplicates point at"""
+        canonical = self.table.canonical[ids]
+        duplicate = canonical != ids
+        for i, canonical_id in zip(ids[duplicate].tolist(), canonical[duplicate].tolist()):
+            if self.table.course[canonical_id] == self.table.course[i]:
+                continue #already in the course's own index
+            borrowed = self.borrowed.setdefault(self.table.course_name(i), [])
+            if canonical_id not in borrowed:
+                borrowed.append(canonical_id)
+
+    def add_lexical(self, course, ids):
+        """Adds chunks to a course's BM25 index under their canonical ids, each text once"""
+        lexical = self.lexical_indexes.setdefault(course, BM25Index())
+        canonical = [i for i in dict.fromkeys(self.table.canonical[ids].tolist()) if i not in lexical.doc_lengths]
+        lexical.add(canonical, [self.table.text_of(i) for i in canonical])
     
-    def retrieve(self, question, num_courses, course_filter=None, k=3):
-        """Given user prompt, retrieves top k relevant chunks """
-        if self.index is None:
-            return []
-        
-        if course_filter:
-            num_filters = len(course_filter)
-            k = num_filters * k
-        
-
-        question_embedding = self.model.encode([question])
-        
-        distances, indices = self.index.search(question_embedding.astype('float32'), num_courses*k*3)
-        
-        results = []
-        retrieved_course_counts = {}
-        for i, dist in zip(indices[0], distances[0]):
-
-
-            retrieved_chunk_course = self.chunk_metadata[i]
-
-            if course_filter and retrieved_chunk_course not in course_filter:
-                continue 
-            
+    def rebuild_indexes(self, backend=None, recall_target=None):
+        """Rebuilds every course index from the stored embeddings, e.g. after a course has grown
+            well past the size its backend was picked for. Returns the per-course reports
+            (backend, tuned nprobe/efSearch and recall@k against a flat scan)"""
+        backend = backend or self.index_backend
+        recall_target = recall_target or self.recall_target
+        for course in list(self.course_indexes):
+            ids = self.table.owned_ids(self.get_course_ids(course, indexed_only=True))
+            self.course_indexes[course], self.index_reports[course] = build_index(
+                self.embeddings[ids], ids, backend, recall_target, precision=self.precision)
+        return self.index_reports
 
-            current_count = retrieved_course_counts.get(retrieved_chunk_course, 0)
+    def save(self, path):
+        """Writes the index, embeddings, chunks and chunk metadata to a versioned directory.
+            Written to a temp dir first and swapped in so a crash never leaves a half saved index"""
+        tmp_path = path.rstrip(os.sep) + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
 
-            if current_count >= 3:
-                continue
+        manifest = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "model_name": self.model_name,
+            "num_chunks": len(self.table),
+            "num_indexed": self.num_indexed,
+            "index_backend": self.index_backend,
+            "recall_target": self.recall_target,
+            "precision": self.precision,
+            "hybrid": self.hybrid,
+            "dedupe": self.near_duplicates is not None,
+            "index_reports": self.index_reports,
+            "dimension": None if self.embeddings is None else int(self.embeddings.shape[1])
+        }
 
-            retrieved_course_counts[retrieved_chunk_course] = current_count + 1
-            
-            retrieved_chunk = self.chunks[i]
+        self.table.save(tmp_path)
+        if self.embeddings is not None:
+            np.save(os.path.join(tmp_path, "embeddings.npy"), np.ascontiguousarray(self.embeddings))
+        # course names can be anything, so index files are numbered and the manifest maps them back
+        manifest["course_indexes"] = {}
+        for n, (course, index) in enumerate(self.course_indexes.items()):
+            filename = f"index_{n}.faiss"
+            faiss.write_index(index, os.path.join(tmp_path, filename))
+            manifest["course_indexes"][course] = filename
+        # manifest last, a directory without one is never treated as a valid index
+        with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        print(f"Saved {len(self.table)} chunks to {path}")
+
+    @classmethod
+    def load(cls, path, mmap=True, embedder=None):
+        """Reloads an index written by save(). Chunk text, embeddings and flat/HNSW course indexes are
+            memory-mapped, and the model is only loaded once a query needs encoding. IVF and IVF-PQ
+            indexes are always read into memory: mapped, their inverted lists are read-only, so new
+            chunks couldn't be added, and saving them again would only write a reference to the file"""
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+
+        if manifest.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version {manifest.get('format_version')} in {path}")
+
+        if embedder is not None and embedder.model_name != manifest["model_name"]:
+            raise ValueError(f"Index in {path} was built with {manifest['model_name']}, not {embedder.model_name}")
+
+        rag = cls(model_name=manifest["model_name"], embedder=embedder,
+                  index_backend=manifest.get("index_backend", 'flat'), recall_target=manifest.get("recall_target", 0.95),
+                  precision=manifest.get("precision", 'float32'), hybrid=manifest.get("hybrid", False),
+                  dedupe=manifest.get("dedupe", False))
+        rag.index_reports = manifest.get("index_reports", {})
+        rag.table = ChunkTable.load(path, use_mmap=mmap)
+        rag.num_indexed = manifest["num_indexed"]
+
+        embeddings_path = os.path.join(path, "embeddings.npy")
+        if os.path.exists(embeddings_path):
+            rag.embeddings = np.load(embeddings_path, mmap_mode='r' if mmap else None)
+
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        for course, filename in manifest["course_indexes"].items():
+            index = faiss.read_index(os.path.join(path, filename), io_flags)
+            if io_flags and faiss.try_extract_index_ivf(index) is not None:
+                index = faiss.read_index(os.path.join(path, filename))
+            rag.course_indexes[course] = index
+
+        # the BM25 indexes and MinHash signatures aren't saved, rebuilding them from the chunk text is quick
+        indexed = rag.table.live_ids(end=rag.num_indexed)
+        rag.add_borrowed(indexed)
+        if rag.near_duplicates is not None:
+            for i in np.unique(rag.table.canonical[rag.table.live_ids()]).tolist():
+                rag.near_duplicates.add(i, rag.table.text_of(i))
+        if rag.hybrid:
+            for course in rag.searchable_courses():
+                rag.add_lexical(course, rag.get_course_ids(course, indexed_only=True))
+
+        print(f"Loaded {len(rag.table)} chunks from {path}")
+        return rag
+
+    def retrieve(self, question, num_courses=None, course_filter=None, k=3):
+        """Given user prompt, retrieves the top k relevant chunks from each course in course_filter
+            (or the top k overall, at most MAX_CHUNKS_PER_COURSE per course, when there is no filter).
+            Only the filtered courses' indexes are searched, so the search is exact and always fills
+            each course's quota when it has enough chunks. num_courses is no longer needed and is ignored"""
+        return self.retrieve_many([(question, course_filter, k)])[0]
+
+    def retrieve_many(self, requests):
+        """Batched retrieve for a list of (question, course_filter, k) requests: all questions are
+            encoded in one model call and each course index is searched once for every query that
+            needs it. Returns one result list per request, in order"""
+        if not self.index:
+            return [[] for _ in requests]
+
+        courses = self.searchable_courses()
+        plans = [plan_search(course_filter, courses, k) for _, course_filter, k in requests]
+        questions = [question for question, _, _ in requests]
+        if self.hybrid:
+            return self.hybrid_search_many(questions, plans)
+        return self.search_many(self.embedder.encode_queries(questions), plans)
+
+    def search(self, question_embedding, courses, per_course, k):
+        """Exact search of only the given courses' indexes for an already encoded question,
+            taking per_course hits from each and returning the k closest overall"""
+        return self.search_many(question_embedding, [(courses, per_course, k)])[0]
+
+    def search_many(self, question_embeddings, plans):
+        """search() for a matrix of encoded questions, one (courses, per_course, k) plan per row"""
+        all_results = []
+        for n, query_hits in enumerate(self.dense_hits(question_embeddings, plans)):
+            results = []
+            seen = set() #the same boilerplate chunk can come back through several courses
+            for dist, i, course in query_hits:
+                if len(results) == plans[n][2]:
+                    break
+                if i in seen:
+                    continue
+                seen.add(i)
+                results.append({
+                    'chunk': self.table.text_of(i), #i may be a removed course's chunk other courses still share
+                    'course': course,
+                    'distance': dist
+                })
+            all_results.append(results)
+
+        return all_results
+
+    def dense_hits(self, question_embeddings, plans):
+        """Per plan, every (distance, chunk id, course) hit from its courses' indexes, closest first.
+            A course's borrowed near-duplicates are scored exactly against their stored embeddings"""
+        queries_by_course = {}
+        for n, (courses, _, _) in enumerate(plans):
+            for course in courses:
+                queries_by_course.setdefault(course, []).append(n)
+
+        hits = [[] for _ in plans]
+        for course, queries in queries_by_course.items():
+            index = self.course_indexes.get(course)
+            borrowed = self.borrowed.get(course)
+            course_hits = [[] for _ in queries]
+            if index is not None:
+                depth = min(max(plans[n][1] for n in queries), index.ntotal)
+                distances, indices = index.search(question_embeddings[queries], depth)
+                for row in range(len(queries)):
+                    course_hits[row] = [(float(dist), int(i)) for i, dist in zip(indices[row], distances[row]) if i >= 0]
+            if borrowed:
+                # squared L2 like the flat indexes, over the handful of shared chunks
+                vectors = np.asarray(self.embeddings[borrowed], dtype='float32')
+                query_vectors = np.asarray(question_embeddings[queries], dtype='float32')
+                distances = ((query_vectors ** 2).sum(axis=1)[:, None] - 2 * query_vectors @ vectors.T
+                             + (vectors ** 2).sum(axis=1)[None, :])
+                for row in range(len(queries)):
+                    course_hits[row].extend(zip(np.maximum(distances[row], 0).tolist(), borrowed))
+                    course_hits[row].sort()
+            for row, n in enumerate(queries):
+                hits[n].extend((dist, i, course) for dist, i in course_hits[row][:plans[n][1]])
+
+        for query_hits in hits:
+            query_hits.sort(key=lambda hit: hit[0])
+        return hits
+
+    def hybrid_search_many(self, questions, plans, embedder=None):
+        """BM25 + dense search fused per course with reciprocal rank fusion. A query skips the dense
+            search entirely when, for every course it searches, the top keyword hit contains all of
+            its keywords and there are enough keyword hits to fill the quota. Results carry the fused
+            'score', and 'distance' is None for chunks only the keyword search found"""
+        embedder = embedder or self.embedder
+
+        lexical = [] #per query, course -> [(bm25 score, chunk id, keywords matched)]
+        need_dense = []
+        for n, (question, (courses, per_course, _)) in enumerate(zip(questions, plans)):
+            by_course = {course: self.lexical_indexes[course].search(question, per_course * HYBRID_DEPTH)
+                         for course in courses if course in self.lexical_indexes}
+            lexical.append(by_course)
+
+            num_keywords = len(keywords(question))
+            confident = num_keywords >= 2 and courses and all(
+                len(by_course.get(course, [])) >= per_course and by_course[course][0][2] == num_keywords
+                for course in courses)
+            if not confident:
+                need_dense.append(n)
+        self.lexical_only_queries += len(plans) - len(need_dense)
+
+        dense = {}
+        if need_dense:
+            dense_plans = [(plans[n][0], plans[n][1] * HYBRID_DEPTH, None) for n in need_dense]
+            question_embeddings = embedder.encode_queries([questions[n] for n in need_dense])
+            dense = dict(zip(need_dense, self.dense_hits(question_embeddings, dense_plans)))
+
+        all_results = []
+        for n, (courses, per_course, k) in enumerate(plans):
+            distances = {i: dist for dist, i, _ in dense.get(n, [])}
+            fused_hits = []
+            for course in courses:
+                lexical_ranking = [i for _, i, _ in lexical[n].get(course, [])]
+                dense_ranking = [i for _, i, hit_course in dense.get(n, []) if hit_course == course]
+                fused = reciprocal_rank_fusion([lexical_ranking, dense_ranking])
+                best = sorted(fused, key=lambda i: -fused[i])[:per_course]
+                fused_hits.extend((fused[i], i, course) for i in best)
+
+            fused_hits.sort(key=lambda hit: -hit[0])
+            results = []
+            seen = set() #the same boilerplate chunk can come back through several courses
+            for score, i, course in fused_hits:
+                if len(results) == k:
+                    break
+                if i in seen:
+                    continue
+                seen.add(i)
+                results.append({
+                    'chunk': self.table.text_of(i),
+                    'course': course,
+                    'distance': distances.get(i),
+                    'score': score
+                })
+            all_results.append(results)
 
-            results.append({
-                'chunk': retrieved_chunk,
-                'course': retrieved_chunk_course,
-                'distance': float(dist)
-            })
+        return all_results
 
 
-            if len(results)>= k:
-                break
-        
-        return results
+def plan_search(course_filter, available_courses, k):
+    """Works out which courses to search, how many hits to take from each, and the total to return"""
+    if course_filter:
+        courses = [c.upper() for c in dict.fromkeys(course_filter) if c.upper() in available_courses]
+        return courses, k, len(courses) * k
+    return list(available_courses), min(k, MAX_CHUNKS_PER_COURSE), k
 
 if __name__ == "__main__":
-    import sys
-    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
     from extraction.pdf_to_text_chunks import process_syllabus
     
     syllabus_dir = "data/duke_syllabi"
@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from .rag_system import RAGSystem, plan_search
+
+class SharedCorpus:
+    """Process-wide store where each distinct syllabus is chunked and embedded exactly once.
+        Documents are keyed by a content hash (the syllabus cache key) and reference counted by
+        the CorpusViews that own them, so memory and ingest work scale with distinct syllabi"""
+
+    def __init__(self, embedder=None, hybrid=False, dedupe=False):
+        # each "course" in the store is one document id, dedupe also shares boilerplate chunks between documents
+        self.store = RAGSystem(embedder=embedder, hybrid=hybrid, dedupe=dedupe)
+        self.embedder = self.store.embedder
+        self.owners = {} #doc_id -> number of student courses pointing at it
+        self._lock = threading.Lock()
+
+    def add_document(self, doc_id, chunks, embeddings=None, pages=None, sections=None):
+        """Stores and indexes a document the first time it's seen, otherwise just adds an owner"""
+        doc_id = doc_id.upper()
+        with self._lock:
+            if doc_id in self.owners:
+                self.owners[doc_id] += 1
+                print(f"Document {doc_id[:12]} already in shared corpus ({self.owners[doc_id]} owners)")
+                return doc_id
+
+            self.store.add_course(doc_id, chunks, embeddings, pages, sections)
+            self.store.index_chunks()
+            self.owners[doc_id] = 1
+            return doc_id
+
+    def release(self, doc_id):
+        """Drops one owner, the document is removed once nobody references it"""
+        with self._lock:
+            if doc_id not in self.owners:
+                return
+            self.owners[doc_id] -= 1
+            if self.owners[doc_id] == 0:
+                del self.owners[doc_id]
+                self.store.remove_course(doc_id)
+
+    def search(self, question_embedding, doc_ids, per_doc, k):
+        return self.store.search(question_embedding, doc_ids, per_doc, k)
+
+    def search_many(self, question_embeddings, plans):
+        return self.store.search_many(question_embeddings, plans)
+
+    def hybrid_search_many(self, questions, plans, embedder=None):
+        return self.store.hybrid_search_many(questions, plans, embedder)
+
+    def get_document_embeddings(self, doc_id, texts=None):
+        return self.store.get_course_embeddings(doc_id, texts)
+
+    def stats(self):
+        """How much storage dedupe is saving: chunks stored vs chunks that every owner would hold privately.
+            chunk_dedupe_ratio is the extra saving from near-duplicate chunks shared between documents"""
+        with self._lock:
+            stored = {doc_id: len(self.store.get_course_ids(doc_id)) for doc_id in self.owners}
+            referenced = sum(stored[doc_id] * owners for doc_id, owners in self.owners.items())
+            stored_chunks = sum(stored.values())
+            chunk_stats = self.store.dedupe_stats()
+            return {
+                "documents": len(self.owners),
+                "references": sum(self.owners.values()),
+                "stored_chunks": stored_chunks,
+                "referenced_chunks": referenced,
+                "dedupe_ratio": referenced / stored_chunks if stored_chunks else 1.0,
+                "embedded_chunks": chunk_stats["stored_chunks"],
+                "chunk_dedupe_ratio": chunk_stats["dedupe_ratio"]
+            }
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class CorpusView:
+    """A student's RAG system on top of a SharedCorpus. Same interface as RAGSystem, but it only
+        holds a course name -> document id map, the chunks and indexes live in the shared corpus"""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.embedder = corpus.embedder
+        self.courses = {} #course name -> doc_id in the corpus
+
+    @property
+    def index(self):
+        return self.courses or None
+
+    def add_course(self, course_name, chunks, embeddings=None, doc_id=None, pages=None, sections=None):
+        """Points course_name at the corpus copy of this syllabus, adding it to the corpus if it's new.
+            doc_id should be the syllabus cache key, otherwise the chunks themselves are hashed"""
+        course_name = course_name.upper()
+        if doc_id is None:
+            doc_id = hashlib.sha256("\x00".join(chunks).encode()).hexdigest()
+
+        if course_name in self.courses:
+            self.remove_course(course_name)
+        self.courses[course_name] = self.corpus.add_document(doc_id, chunks, embeddings, pages, sections)
+
+    def index_chunks(self):
+        """Documents are indexed by the corpus as they're added, kept for RAGSystem compatibility"""
+
+    def remove_course(self, course_name):
+        doc_id = self.courses.pop(course_name.upper(), None)
+        if doc_id is None:
+            print(f"{course_name} has no chunks to remove")
+            return False
+        self.corpus.release(doc_id)
+        return True
+
+    def replace_course(self, course_name, chunks, embeddings=None, doc_id=None):
+        self.add_course(course_name, chunks, embeddings, doc_id)
+
+    def document_ids(self, course_names):
+        """Corpus document id of each course, None for courses this student doesn't have"""
+        return [self.courses.get(course_name.upper()) for course_name in course_names]
+
+    def get_course_embeddings(self, course_name, texts=None):
+        doc_id = self.courses.get(course_name.upper())
+        if doc_id is None:
+            return None
+        return self.corpus.get_document_embeddings(doc_id, texts)
+
+    def retrieve(self, question, num_courses=None, course_filter=None, k=3):
+        """Same contract as RAGSystem.retrieve, searching only this student's documents"""
+        return self.retrieve_many([(question, course_filter, k)])[0]
+
+    def retrieve_many(self, requests):
+        """Same contract as RAGSystem.retrieve_many, one encode call and one corpus search for the batch"""
+        if not self.courses:
+            return [[] for _ in requests]
+
+        doc_plans = []
+        doc_courses = [] #per request, doc_id -> course name to label its hits with
+        for _, course_filter, k in requests:
+            courses, per_course, k = plan_search(course_filter, self.courses, k)
+            # the same syllabus added under two names is only searched once, under the first name
+            labels = {}
+            for course in courses:
+                labels.setdefault(self.courses[course], course)
+            doc_plans.append((list(labels), per_course, k))
+            doc_courses.append(labels)
+
+        questions = [question for question, _, _ in requests]
+        if self.corpus.store.hybrid:
+            all_results = self.corpus.hybrid_search_many(questions, doc_plans, self.embedder)
+        else:
+            all_results = self.corpus.search_many(self.embedder.encode_queries(questions), doc_plans)
+        for results, labels in zip(all_results, doc_courses):
+            for result in results:
+                result['course'] = labels[result['course']]
+        return all_results
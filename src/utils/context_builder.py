@@ -0,0 +1,103 @@
+import json
+from extraction.structured_chunker import SENTENCE_END, approx_token_count
+from rag.lexical_index import keywords
+
+
+def normalized(text):
+    return ' '.join(text.lower().split())
+
+
+def compact_summary(summary):
+    """GradeCalculator.get_summary() without the fields the model can work out itself
+        (check, remaining) and with rounded numbers"""
+    def rounded(value):
+        return None if value is None else round(value, 1)
+
+    return {
+        "course": summary["course"],
+        "grade": rounded(summary["current_grade"]),
+        "categories": {
+            category: {
+                "weight": rounded(info["weight"]),
+                "avg": rounded(info["average"]),
+                "done": f"{info['completed']}/{info['total']}"
+            }
+            for category, info in summary["categories"].items()
+        }
+    }
+
+
+class ContextBuilder:
+    """Builds the answer prompt's syllabus context and grade data within a token budget.
+        Retrieved chunks are taken best first, alternating between courses so each course gets its
+        top chunk in, duplicates (the same text, or text already inside a chosen chunk) are skipped
+        and a chunk that doesn't fit is cut down to the sentences sharing the most words with the
+        question. Grades are serialized compactly for the courses the question is about only"""
+
+    def __init__(self, max_context_tokens=1200, count_tokens=None, min_piece_tokens=30):
+        self.max_context_tokens = max_context_tokens
+        self.count_tokens = count_tokens or approx_token_count
+        self.min_piece_tokens = min_piece_tokens #a trimmed chunk shorter than this isn't worth including
+
+    @staticmethod
+    def interleave(results):
+        """Results reordered round robin over courses, keeping each course's own ranking"""
+        by_course = {}
+        for result in results:
+            by_course.setdefault(result['course'], []).append(result)
+        ranked = []
+        for rank in range(max((len(course_results) for course_results in by_course.values()), default=0)):
+            ranked += [course_results[rank] for course_results in by_course.values() if rank < len(course_results)]
+        return ranked
+
+    def trim(self, text, budget, question=""):
+        """The sentences of text that fit in budget tokens, those sharing the most keywords with the
+            question first (earlier ones on ties), joined back in their original order. None when
+            less than min_piece_tokens would be left"""
+        question_words = set(keywords(question))
+        sentences = SENTENCE_END.split(text)
+        order = sorted(range(len(sentences)), key=lambda n: (-len(question_words & set(keywords(sentences[n]))), n))
+        kept, tokens = [], 0
+        for n in order:
+            sentence_tokens = self.count_tokens(sentences[n])
+            if tokens + sentence_tokens <= budget:
+                kept.append(n)
+                tokens += sentence_tokens
+        if tokens < self.min_piece_tokens:
+            return None
+        return ' '.join(sentences[n] for n in sorted(kept))
+
+    def chunk_context(self, results, question=""):
+        """(context text, stats) for the retrieved chunks, stats has tokens, chunks, duplicates,
+            trimmed and dropped counts"""
+        pieces, seen = [], []
+        stats = {"tokens": 0, "chunks": 0, "duplicates": 0, "trimmed": 0, "dropped": 0}
+        for result in self.interleave(results):
+            text = result['chunk'].strip()
+            key = normalized(text)
+            if any(key in other for other in seen):
+                stats["duplicates"] += 1
+                continue
+
+            label = f"[{result['course']}] "
+            remaining = self.max_context_tokens - stats["tokens"] - self.count_tokens(label)
+            tokens = self.count_tokens(text)
+            if tokens > remaining:
+                text = self.trim(text, remaining, question)
+                if text is None:
+                    stats["dropped"] += 1
+                    continue
+                stats["trimmed"] += 1
+                tokens = self.count_tokens(text)
+
+            seen.append(key)
+            pieces.append(label + text)
+            stats["tokens"] += tokens + self.count_tokens(label)
+            stats["chunks"] += 1
+        return "\n\n".join(pieces), stats
+
+    def grade_context(self, summaries):
+        """Compact JSON of the grade summaries, empty string when there are none"""
+        if not summaries:
+            return ""
+        return json.dumps([compact_summary(summary) for summary in summaries], separators=(',', ':'))
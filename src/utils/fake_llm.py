@@ -0,0 +1,127 @@
+import asyncio
+import json
+import re
+import time
+from types import SimpleNamespace
+from utils.query_resolver import needs_grades
+
+
+class FakeAnthropic:
+    """Offline stand-in for anthropic.Anthropic with the parts the app uses: messages.create and
+        messages.stream. Replies are canned (rewriter JSON, a fixed grading structure, or an answer
+        echoing the start of the prompt) and streamed word by word with a delay, so the UI and the
+        time-to-first-token numbers can be checked without an API key. Set FAKE_LLM=1 to use it in the app"""
+
+    def __init__(self, first_token_delay=0.3, token_delay=0.02):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.messages = FakeMessages(self)
+
+
+class FakeMessages:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, max_tokens, messages, system=None, **kwargs):
+        text = reply(system or "", messages[-1]["content"])
+        time.sleep(self.client.first_token_delay + self.client.token_delay * len(text.split()))
+        return make_message(text, system, messages)
+
+    def stream(self, model, max_tokens, messages, system=None, **kwargs):
+        return FakeStream(self.client, reply(system or "", messages[-1]["content"]), system, messages)
+
+
+class FakeStream:
+    """Context manager shaped like the SDK's MessageStream: iterate text_stream, then get_final_message()"""
+
+    def __init__(self, client, text, system, messages):
+        self.client = client
+        self.text = text
+        self.system = system
+        self.messages = messages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        time.sleep(self.client.first_token_delay)
+        for n, word in enumerate(self.text.split(" ")):
+            if n:
+                time.sleep(self.client.token_delay)
+            yield word if n == 0 else " " + word
+
+    def get_final_message(self):
+        return make_message(self.text, self.system, self.messages)
+
+
+class FakeAsyncAnthropic(FakeAnthropic):
+    """FakeAnthropic for the asyncio path, shaped like anthropic.AsyncAnthropic"""
+
+    def __init__(self, first_token_delay=0.3, token_delay=0.02):
+        super().__init__(first_token_delay, token_delay)
+        self.messages = FakeAsyncMessages(self)
+
+
+class FakeAsyncMessages(FakeMessages):
+    async def create(self, model, max_tokens, messages, system=None, **kwargs):
+        text = reply(system or "", messages[-1]["content"])
+        await asyncio.sleep(self.client.first_token_delay + self.client.token_delay * len(text.split()))
+        return make_message(text, system, messages)
+
+    def stream(self, model, max_tokens, messages, system=None, **kwargs):
+        return FakeAsyncStream(self.client, reply(system or "", messages[-1]["content"]), system, messages)
+
+
+class FakeAsyncStream(FakeStream):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        await asyncio.sleep(self.client.first_token_delay)
+        for n, word in enumerate(self.text.split(" ")):
+            if n:
+                await asyncio.sleep(self.client.token_delay)
+            yield word if n == 0 else " " + word
+
+    async def get_final_message(self):
+        return make_message(self.text, self.system, self.messages)
+
+
+def make_message(text, system, messages):
+    # rough usage numbers, about 4 characters per token
+    prompt_chars = len(system or "") + sum(len(str(message["content"])) for message in messages)
+    usage = SimpleNamespace(input_tokens=prompt_chars // 4, output_tokens=len(text) // 4)
+    return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], usage=usage, stop_reason="end_turn")
+
+
+def reply(system, prompt):
+    if "query rewriter" in system:
+        current = re.search(r"Current: (.*)", prompt)
+        courses = re.search(r"Courses: (\[.*\])", prompt)
+        question = current.group(1).strip() if current else prompt
+        course_list = json.loads(courses.group(1).replace("'", '"')) if courses else []
+        mentioned = [course for course in course_list if course.lower() in question.lower()]
+        return json.dumps({
+            "question": question,
+            "courses": mentioned or course_list,
+            "skip_RAG": False,
+            "needs_grades": needs_grades(question),
+            "context_summary": ""
+        })
+
+    if "extract the grading structure" in prompt:
+        return json.dumps({
+            "grading_breakdown": {"homeworks": 0.4, "exams": 0.5, "participation": 0.1},
+            "assignment_counts": {"homeworks": 4, "exams": 2, "participation": 1}
+        })
+
+    context = " ".join(prompt.split()[:40])
+    return f"(offline answer) Based on the syllabus context I found: {context} ..."
@@ -1,3 +1,8 @@
+import itertools
+
+_calculator_ids = itertools.count()
+
+
 class GradeCalculator:
     def __init__(self, name, grading_breakdown, assignment_counts):
         """
@@ -8,6 +13,8 @@ class GradeCalculator:
         self.grading_breakdown = grading_breakdown
         self.assignment_counts = assignment_counts
         self.grades = {} # % grade(s) under each category
+        self.uid = next(_calculator_ids) #unique per calculator in the process, unlike id() it's never reused
+        self.version = 0 #bumped by every change, cached answers that used the grade summary check it
         for category in grading_breakdown.keys():  # ["homeworks", "midterm",....]
             self.grades[category] = []
 
@@ -20,6 +27,7 @@ class GradeCalculator:
         
         percentage = (score / max_score) * 100
         self.grades[category].append(percentage)
+        self.version += 1
         return True
 
     def add_category(self, category, weight=0.0, counts=1):
@@ -31,6 +39,7 @@ class GradeCalculator:
         self.grading_breakdown[category] = weight
         self.assignment_counts[category] = counts
 
+        self.version += 1
         return True
     
     def get_category_grade(self, category):
@@ -94,6 +103,7 @@ class GradeCalculator:
         self.grading_breakdown[new_category_name] = self.grading_breakdown.pop(category)
         self.assignment_counts[new_category_name] = self.assignment_counts.pop(category)
         self.grades[new_category_name] = self.grades.pop(category)
+        self.version += 1
         return True
 
 
@@ -104,6 +114,7 @@ class GradeCalculator:
             return False
         
         self.assignment_counts[category] = count
+        self.version += 1
         return True
 
         
@@ -119,6 +130,7 @@ class GradeCalculator:
         
         i = self.grades[category].index(old_score)
         self.grades[category][i] = new_score
+        self.version += 1
         return True
 
     def remove_category(self, category):
@@ -130,6 +142,7 @@ class GradeCalculator:
         self.grading_breakdown.pop(category)
         self.assignment_counts.pop(category)
         self.grades.pop(category)
+        self.version += 1
         return True
 
     def remove_grade(self, category, score):
@@ -142,6 +155,7 @@ class GradeCalculator:
             return False
 
         self.grades[category].remove(score)
+        self.version += 1
         return True
 
 
@@ -0,0 +1,150 @@
+import anthropic
+import asyncio
+import os
+import random
+import threading
+import weakref
+from dotenv import load_dotenv
+from utils.fake_llm import FakeAnthropic, FakeAsyncAnthropic
+
+load_dotenv()
+
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30")) #seconds per request, and between streamed chunks
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16")) #in-flight requests per event loop
+MAX_RETRIES = 4
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529} #529 is Anthropic's "overloaded"
+
+_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary() #event loop -> AsyncLLMClient
+
+
+def use_fake_llm():
+    return os.getenv("FAKE_LLM", "").lower() in ("1", "true")
+
+
+def get_llm_client():
+    """The process-wide synchronous client, so every session reuses one connection pool.
+        FAKE_LLM=1 gives the offline FakeAnthropic instead"""
+    global _client
+    with _lock:
+        if _client is None:
+            if use_fake_llm():
+                _client = FakeAnthropic()
+            else:
+                _client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), timeout=REQUEST_TIMEOUT)
+    return _client
+
+
+def get_async_llm_client():
+    """The AsyncLLMClient of the running event loop. An httpx connection pool belongs to the loop
+        that opened it, Gradio runs every async handler on one loop so that's one per process"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = AsyncLLMClient(FakeAsyncAnthropic() if use_fake_llm() else None)
+        return _async_clients[loop]
+
+
+class AsyncLLMClient:
+    """AsyncAnthropic behind a concurrency limit, with request timeouts and backoff on rate limits,
+        overloads and dropped connections. The SDK's own retries are turned off so that waiting
+        requests give up their slot, and a 429 pauses every request on the client until its
+        retry-after has passed rather than having each one find out for itself"""
+
+    def __init__(self, client=None, max_concurrency=MAX_CONCURRENCY, timeout=REQUEST_TIMEOUT,
+                 max_retries=MAX_RETRIES, base_delay=0.5, max_delay=30.0):
+        self.client = client or anthropic.AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"), timeout=timeout, max_retries=0
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.resume_at = 0.0 #loop time before which no new request is sent, set by a 429
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, or None when it shouldn't be retried"""
+        if isinstance(error, (asyncio.TimeoutError, anthropic.APITimeoutError)):
+            self.stats["timeouts"] += 1
+        elif isinstance(error, anthropic.APIStatusError):
+            if error.status_code not in RETRY_STATUSES:
+                return None
+        elif not isinstance(error, anthropic.APIConnectionError):
+            return None
+        if attempt >= self.max_retries:
+            return None
+
+        # exponential backoff with full jitter, but never sooner than the server asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if isinstance(error, anthropic.APIStatusError):
+            try:
+                delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+            if error.status_code == 429:
+                self.stats["rate_limited"] += 1
+                loop = asyncio.get_running_loop()
+                self.resume_at = max(self.resume_at, loop.time() + delay)
+        return delay
+
+    async def acquire(self):
+        """Waits out any rate limit pause, then takes a concurrency slot"""
+        loop = asyncio.get_running_loop()
+        while self.resume_at > loop.time():
+            await asyncio.sleep(self.resume_at - loop.time())
+        await self.semaphore.acquire()
+        self.stats["requests"] += 1
+        self.stats["in_flight"] += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def release(self):
+        self.stats["in_flight"] -= 1
+        self.semaphore.release()
+
+    async def backoff(self, error, attempt):
+        """Sleeps before the next attempt, re-raising error when it isn't worth retrying"""
+        delay = self.retry_delay(error, attempt)
+        if delay is None:
+            raise error
+        self.stats["retries"] += 1
+        print(f"LLM request failed ({type(error).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def create(self, **kwargs):
+        """messages.create, takes the same arguments"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire()
+            try:
+                return await asyncio.wait_for(self.client.messages.create(**kwargs), self.timeout)
+            except Exception as e:
+                error = e
+            finally:
+                self.release()
+            await self.backoff(error, attempt)
+
+    async def stream(self, **kwargs):
+        """messages.stream as an async generator of text. Failures are only retried until the
+            first text arrives, after that part of the answer is already on screen so they're raised"""
+        for attempt in range(self.max_retries + 1):
+            started = False
+            await self.acquire()
+            try:
+                async with self.client.messages.stream(**kwargs) as stream:
+                    texts = aiter(stream.text_stream)
+                    while True:
+                        try:
+                            text = await asyncio.wait_for(anext(texts), self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield text
+            except Exception as e:
+                if started:
+                    raise
+                error = e
+            finally:
+                self.release()
+            await self.backoff(error, attempt)
@@ -0,0 +1,147 @@
+import re
+
+# words that point back at earlier turns, the LLM rewriter has to resolve these
+REFERENCE_WORDS = {
+    "it", "its", "it's", "that", "this", "these", "those", "they", "them", "their", "he", "she",
+    "his", "her", "same", "again", "other", "others", "else", "also", "too", "instead",
+    "previous", "earlier", "above", "former", "latter", "compare", "comparison", "versus", "vs", "than"
+}
+REFERENCE_PHRASES = re.compile(r"\b(?:how|what) about\b|\bwhich one\b|\band (?:for|in)\b|^(?:and|but|or|so)\b")
+ALL_COURSES = re.compile(r"\b(?:all|every|each|both) (?:of )?(?:my )?(?:classes|courses|class|course)\b")
+ACADEMIC_WORDS = {
+    "class", "classes", "course", "courses", "syllabus", "grade", "grades", "grading", "gpa", "exam", "exams",
+    "midterm", "midterms", "final", "finals", "quiz", "quizzes", "homework", "homeworks", "assignment",
+    "assignments", "project", "projects", "lab", "labs", "policy", "late", "attendance", "participation",
+    "professor", "instructor", "ta", "office", "lecture", "lectures", "deadline", "deadlines", "regrade",
+    "score", "scores", "points", "percent", "weight", "weighted", "curve", "credit", "study", "textbook",
+    "collaboration", "drop", "dropped", "extension", "semester", "need", "pass", "fail"
+}
+OFF_TOPIC_WORDS = {
+    "weather", "forecast", "recipe", "cook", "restaurant", "restaurants", "movie", "movies", "song", "songs",
+    "music", "joke", "jokes", "trip", "vacation", "flight", "flights", "hotel", "stock", "stocks", "bitcoin",
+    "crypto", "football", "basketball", "soccer", "nba", "nfl", "game", "games", "celebrity", "dating",
+    "horoscope", "lottery", "news", "election", "poem", "story"
+}
+# words that make a question about the student's own standing, so their grade summaries go in the prompt
+GRADE_WORDS = {
+    "grade", "grades", "gpa", "score", "scores", "scored", "got", "get", "getting", "average", "standing",
+    "doing", "current", "currently", "pass", "passing", "fail", "failing", "need", "needed", "chance",
+    "chances", "letter", "percent", "percentage", "points", "curve", "mark", "marks"
+}
+SMALL_TALK = re.compile(r"^(?:hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|bye|goodbye|good (?:morning|night))\b[\s!.]*$")
+# common ways of naming a department, mapped to course code prefixes
+ALIASES = {
+    "psych": "PSY", "psychology": "PSY", "cs": "CS", "compsci": "CS", "comp sci": "CS", "computer science": "CS",
+    "econ": "ECON", "economics": "ECON", "math": "MATH", "stats": "STA", "statistics": "STA", "bio": "BIO",
+    "biology": "BIO", "chem": "CHEM", "chemistry": "CHEM", "physics": "PHYS", "history": "HIST",
+    "english": "ENGLISH", "writing": "WRITING", "philosophy": "PHIL", "ece": "ECE", "engineering": "EGR"
+}
+COURSE_CODE = re.compile(r"\b([a-z]{2,7})[\s-]?(\d{2,3}[a-z]?)\b")
+WORD = re.compile(r"[a-z0-9']+")
+
+
+def normalize_course(name):
+    return re.sub(r"[^A-Z0-9]", "", name.upper())
+
+
+def needs_grades(text):
+    """Whether answering the question may take the student's grades: a grade word, or a number that
+        isn't part of a course code ("got 85", "90%"). Only plain syllabus questions come out False"""
+    text = text.lower()
+    if set(WORD.findall(text)) & GRADE_WORDS:
+        return True
+    return bool(re.search(r"\d", COURSE_CODE.sub(" ", text)))
+
+
+def department(course):
+    """Letters before the number of a course code, "PSY277" -> "PSY\""""
+    return re.sub(r"\d.*", "", normalize_course(course))
+
+
+class QueryResolver:
+    """Rule based stand-in for the LLM query rewriter, for messages that don't need one: the course
+        is named outright (code or a department alias like "my psych class"), nothing refers back to
+        earlier turns, or the message is plainly small talk/off-topic. resolve() returns the rewriter's
+        JSON shape, needs_grades included, or None when it isn't sure and the rewriter should be asked"""
+
+    def __init__(self):
+        self.patterns = {} #tuple of courses -> [(course, compiled pattern)]
+
+    def course_patterns(self, courses):
+        """Case, space and hyphen insensitive patterns for each course, "CS316" matches "cs 316" and "CS-316\""""
+        key = tuple(courses)
+        if key not in self.patterns:
+            patterns = []
+            for course in courses:
+                code = COURSE_CODE.fullmatch(normalize_course(course).lower())
+                if code:
+                    pattern = rf"\b{code.group(1)}[\s-]?{code.group(2)}\b"
+                else:
+                    pattern = rf"\b{re.escape(course.lower())}\b"
+                patterns.append((course, re.compile(pattern)))
+            self.patterns[key] = patterns
+        return self.patterns[key]
+
+    def mentioned_courses(self, text, courses):
+        """(courses named in text, course codes named that aren't in courses), or (None, None) when a
+            department alias matches more than one course"""
+        mentioned = [course for course, pattern in self.course_patterns(courses) if pattern.search(text)]
+
+        # codes from a department the student takes (or a well known one) that aren't on their list,
+        # other letters-then-number runs ("got 85") aren't course codes
+        known = {normalize_course(course) for course in courses}
+        departments = {department(course) for course in courses} | set(ALIASES.values())
+        unknown = []
+        for code in COURSE_CODE.finditer(text):
+            name = normalize_course(code.group(1) + code.group(2))
+            if code.group(1).upper() in departments and name not in known and name not in unknown:
+                unknown.append(name)
+
+        for alias, prefix in ALIASES.items():
+            if re.search(rf"\b{alias}\b(?![\s-]?\d)", text): #"cs 316" is a code, not the alias
+                matches = [course for course in courses if department(course) == prefix]
+                if set(matches) & set(mentioned):
+                    continue
+                if len(matches) > 1:
+                    return None, None
+                mentioned += matches
+        return mentioned, unknown
+
+    def resolve(self, user_message, courses, history=()):
+        text = ' '.join(user_message.lower().split())
+        words = set(WORD.findall(text))
+
+        if SMALL_TALK.match(text):
+            return self.result(user_message, [], True, "User is making small talk, reply briefly", False)
+
+        if words & REFERENCE_WORDS or REFERENCE_PHRASES.search(text):
+            return None
+        mentioned, unknown = self.mentioned_courses(text, courses)
+        if mentioned is None:
+            return None
+
+        if not mentioned and not unknown:
+            if words & OFF_TOPIC_WORDS and not words & ACADEMIC_WORDS:
+                return self.result(user_message, [], True, "Question is off-topic, unrelated to the student's courses", False)
+            if ALL_COURSES.search(text) and not history:
+                return self.result(user_message, list(courses), False, needs_grades=needs_grades(text))
+            if len(courses) == 1 and not history and words & ACADEMIC_WORDS:
+                return self.result(user_message, list(courses), False, needs_grades=needs_grades(text))
+            return None
+
+        if unknown and not mentioned:
+            return self.result(user_message, [], True,
+                               f"User is asking about {', '.join(unknown)} but it is not in their course list", False)
+        if unknown:
+            return None #some courses are theirs and some aren't, let the rewriter sort it out
+        return self.result(user_message, mentioned, False, needs_grades=needs_grades(text))
+
+    @staticmethod
+    def result(question, courses, skip_rag, context_summary="", needs_grades=True):
+        return {
+            "question": question,
+            "courses": courses,
+            "skip_RAG": skip_rag,
+            "needs_grades": needs_grades,
+            "context_summary": context_summary
+        }
@@ -1,17 +1,28 @@
-import anthropic
 import os
 import json
 from dotenv import load_dotenv
+from utils.llm_client import get_llm_client, get_async_llm_client
 
 load_dotenv()
 
 class SyllabusParser:
-    def __init__(self):
-        self.client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    def __init__(self, client=None, async_client=None):
+        self.client = client or get_llm_client() #shared with every chat unless given its own
+        self.async_client = async_client #an AsyncLLMClient, None for the one on the running event loop
     
     def parse_grading_structure(self, syllabus_text):
         """Extracts grading breakdown from syllabus text"""
-        
+        response = self.client.messages.create(**self.grading_request(syllabus_text))
+        return self.read_grading(response)
+
+    async def aparse_grading_structure(self, syllabus_text):
+        """parse_grading_structure on the event loop, through the shared async client"""
+        client = self.async_client or get_async_llm_client()
+        response = await client.create(**self.grading_request(syllabus_text))
+        return self.read_grading(response)
+
+    def grading_request(self, syllabus_text):
+        """Arguments of the grading extraction's messages.create call"""
         prompt = f"""Analyze this course syllabus and extract the grading structure.
 
 Syllabus text:
@@ -54,12 +65,14 @@ Important:
 
 Return ONLY the JSON, no other text."""
 
-        response = self.client.messages.create(
+        return dict(
             model="claude-sonnet-4-20250514",
             max_tokens=1000,
             messages=[{"role": "user", "content": prompt}]
         )
-        
+
+    def read_grading(self, response):
+        """The grading JSON with every category given an assignment count, None if it isn't valid"""
         json_text = response.content[0].text.strip()
         
         # AI generated: Claude (66-84)